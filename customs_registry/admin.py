@@ -6,20 +6,51 @@ from .forms import CustomsPointForm, MethodOfDiscoveryForm, ViolationAdminForm
 from .models import TJK, City, Country, DernewGornush, DernewNetijesi,ProductCategory, TransportCompanyName, VehicleBrand, CustomsOffice, CustomsPoint, LettersForAction, Product, StoredGood, StoredGoodImage, UnitOfMeasurement, MethodOfDiscovery, ReasonForRuleViolation, BasisForDiscovery, Violation, Workgroup, MilitaryName, Position, AdministrationCodex, CustomsOfficer
 from django.utils import translation
 from django.utils.translation import gettext_lazy as _ , get_language
-from django.http import HttpResponse
-from django.utils import timezone
 from django.utils import formats
 from django.utils.html import format_html
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, Border, PatternFill, Font, Side
-import openpyxl
+from openpyxl.styles import Alignment, PatternFill, Font
+from report.exporters import THIN_BORDER, Column, Exporter, naive_localtime
+from report.jobs import background_export_action
+from report.pagination import KeysetChangeList, KeysetPaginationMixin, PaginatedInlineMixin
+from .choices import CachedChoicesMixin
+from .similarity import SimilaritySearchAdminMixin, SimilaritySearchChangeList
+from .thumbnails import get_thumbnail_url
 
 
-class CustomsPointInline(admin.TabularInline):  # or admin.StackedInline
+class CustomsPointInline(PaginatedInlineMixin, admin.TabularInline):  # or admin.StackedInline
     model = CustomsPoint
     extra = 1  # Number of empty forms to display by default
 
 
+class CustomsOfficeExporter(Exporter):
+    sheet_title = "Customs Offices"
+    filename = 'customs_offices'
+
+    styles = {
+        'customs_header': dict(
+            font=Font(bold=True, color="FFFFFF"),
+            fill=PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid"),
+            border=THIN_BORDER,
+            alignment=Alignment(horizontal="center"),
+        ),
+    }
+    header_style = 'customs_header'
+
+    columns = [
+        Column('Name', 'name'),
+        Column('Created At', lambda office: naive_localtime(office.created_at)),
+        Column('Updated At', lambda office: naive_localtime(office.updated_at)),
+    ]
+
+    def get_filename(self, file_format):
+        return f"customs_offices_{translation.get_language()}.{file_format}"
+
+
+def write_customs_offices_workbook(queryset, output, progress=None):
+    """Write the customs offices workbook into ``output``."""
+    CustomsOfficeExporter().write(queryset, output, progress=progress)
+
+
 @admin.register(CustomsOffice)
 class CustomsOfficeAdmin(admin.ModelAdmin):
     # Fields to display in the list view
@@ -50,70 +81,21 @@ class CustomsOfficeAdmin(admin.ModelAdmin):
     )
     
     # Add bulk actions (including the Excel export)
-    actions = ['export_to_csv', 'export_to_excel']  # Include both actions
+    actions = [
+        'export_to_csv',
+        'export_to_excel',
+        background_export_action('customs_offices', _("Export selected customs offices to Excel in the background")),
+    ]
 
 
 
-   # Custom admin action: Example to export data as Excel
+    def export_to_csv(self, request, queryset):
+        return CustomsOfficeExporter().response(queryset, 'csv', user=request.user)
+
+    export_to_csv.short_description = _("Export selected customs offices to CSV")
+
     def export_to_excel(self, request, queryset):
-        # Define styles
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-        border = Border(left=Side(border_style="thin"), 
-                        right=Side(border_style="thin"), 
-                        top=Side(border_style="thin"), 
-                        bottom=Side(border_style="thin"))
-
-        # Get the current language
-        current_language = translation.get_language()
-        
-        # Define headers based on the current language
-        if current_language == 'tk':  # Turkmen
-            headers = ['Name', 'Created At', 'Updated At']
-        else:  # Default to English
-            headers = ['Name', 'Created At', 'Updated At']
-        
-        # Create a new workbook and select the active worksheet
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Customs Offices"
-        
-        # Write the headers to the first row with formatting
-        ws.append(headers)
-        for cell in ws[1]:
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = border
-            cell.alignment = Alignment(horizontal="center")
-        
-        # Write the data rows
-        for office in queryset:
-            created_at_naive = office.created_at.astimezone(timezone.get_current_timezone()).replace(tzinfo=None)
-            updated_at_naive = office.updated_at.astimezone(timezone.get_current_timezone()).replace(tzinfo=None)
-            
-            ws.append([office.name, created_at_naive, updated_at_naive])
-        
-        # Adjust column widths
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column].width = adjusted_width
-        
-        # Create the HTTP response with the appropriate Excel content type
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="customs_offices_{current_language}.xlsx"'
-        
-        # Save the workbook to the response
-        wb.save(response)
-        
-        return response
+        return CustomsOfficeExporter().response(queryset, user=request.user)
 
     export_to_excel.short_description = _("Export selected customs offices to Excel")
 
@@ -121,73 +103,47 @@ class CustomsOfficeFilter(AutocompleteFilter):
     title = _('CustomsOffice') # display title
     field_name = 'customsoffice' # name of the foreign key field
     
+class CustomsPointExporter(CustomsOfficeExporter):
+    sheet_title = _("Customs Points")
+    filename = 'customs_points'
+
+    columns = [
+        Column(_('Name'), 'name'),
+        Column(_('Customs Office'), 'customsoffice__name'),
+        Column(_('Created At'), lambda point: formats.date_format(point.created_at, "DATETIME_FORMAT", use_l10n=True)),
+        Column(_('Updated At'), lambda point: formats.date_format(point.updated_at, "DATETIME_FORMAT", use_l10n=True)),
+    ]
+
+    def get_queryset(self, queryset):
+        return queryset.select_related('customsoffice')
+
+    def get_headers(self):
+        headers = super().get_headers()
+        # The Turkmen export uses its own word for the name column
+        if get_language() == 'tk':
+            headers[0] = str(_('Ady'))
+        return headers
+
+    def get_filename(self, file_format):
+        return f"customs_points_{get_language()}.{file_format}"
+
+
+def write_customs_points_workbook(queryset, output, progress=None):
+    """Write the customs points workbook into ``output``."""
+    CustomsPointExporter().write(queryset, output, progress=progress)
+
+
 def export_to_excel_customs_point(modeladmin, request, queryset):
-    # Define styles
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    border = Border(left=Side(border_style="thin"), 
-                    right=Side(border_style="thin"), 
-                    top=Side(border_style="thin"), 
-                    bottom=Side(border_style="thin"))
-
-    # Get the current language
-    current_language = get_language()
-    
-    # Define headers based on the current language
-    if current_language == 'tk':  # Turkmen
-        headers = [str(_('Ady')), str(_('Customs Office')), str(_('Created At')), str(_('Updated At'))]
-    else:  # Default to English
-        headers = [str(_('Name')), str(_('Customs Office')), str(_('Created At')), str(_('Updated At'))]
-
-    # Create a new workbook and select the active worksheet
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = str(_("Customs Points"))
-
-    # Write the headers to the first row with formatting
-    ws.append(headers)
-    for cell in ws[1]:
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = border
-        cell.alignment = Alignment(horizontal="center")
-
-    # Write the data rows
-    for point in queryset:
-        created_at_formatted = formats.date_format(point.created_at, "DATETIME_FORMAT", use_l10n=True)
-        updated_at_formatted = formats.date_format(point.updated_at, "DATETIME_FORMAT", use_l10n=True)
-        
-        ws.append([
-            point.name,
-            point.customsoffice.name,
-            created_at_formatted,
-            updated_at_formatted,
-        ])
-
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(cell.value)
-            except (AttributeError, TypeError) as e:
-                # Handle specific exceptions or ignore
-                print(f"Skipping cell due to error: {e}")
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column].width = adjusted_width
-
-    # Create the HTTP response with the appropriate Excel content type
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="customs_points_{current_language}.xlsx"'
-
-    # Save the workbook to the response
-    wb.save(response)
-
-    return response
+    return CustomsPointExporter().response(queryset, user=request.user)
 
 export_to_excel_customs_point.short_description = _("Export selected customs points to Excel")
 
+
+def export_to_csv_customs_point(modeladmin, request, queryset):
+    return CustomsPointExporter().response(queryset, 'csv', user=request.user)
+
+export_to_csv_customs_point.short_description = _("Export selected customs points to CSV")
+
 @admin.register(CustomsPoint)
 class CustomsPointAdmin(admin.ModelAdmin):
     form = CustomsPointForm
@@ -197,9 +153,13 @@ class CustomsPointAdmin(admin.ModelAdmin):
     autocomplete_fields = ['customsoffice'] 
     list_per_page = 15
     prepopulated_fields = {'name': ('customsoffice',)}
-    actions = [export_to_excel_customs_point]  # Add the export action
+    actions = [
+        export_to_excel_customs_point,
+        export_to_csv_customs_point,
+        background_export_action('customs_points', _("Export selected customs points to Excel in the background")),
+    ]
 
-class CityInline(admin.TabularInline):  # or admin.StackedInline
+class CityInline(PaginatedInlineMixin, admin.TabularInline):  # or admin.StackedInline
     model = City
     extra = 1  # Number of empty forms to display
 
@@ -222,9 +182,10 @@ class CountryAdmin(admin.ModelAdmin):
     )
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(SimilaritySearchAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'productcategory','created_at', 'updated_at')
     search_fields = ('name',)
+    similarity_search_fields = ('name',)
     list_filter = ('created_at','productcategory')
     ordering = ('name',)
     readonly_fields = ('created_at', 'updated_at')
@@ -391,7 +352,7 @@ class AdministrationCodexAdmin(admin.ModelAdmin):
     )
     
 @admin.register(CustomsOfficer)
-class CustomsOfficerAdmin(admin.ModelAdmin):
+class CustomsOfficerAdmin(SimilaritySearchAdminMixin, admin.ModelAdmin):
 
     list_display = ('full_name', 'position', 'militaryname', 'created_at', 'updated_at')
 
@@ -399,6 +360,8 @@ class CustomsOfficerAdmin(admin.ModelAdmin):
 
     search_fields = ('name', 'surname', 'midname', 'position__name', 'militaryname__name')
 
+    similarity_search_fields = ('name', 'surname', 'midname')
+
     autocomplete_fields = ['position', 'militaryname']
 
     readonly_fields = ('created_at', 'updated_at')
@@ -427,10 +390,15 @@ class CitizenshipFilter(AutocompleteFilter):
     title = _('Raýatlylygy')
     field_name = 'nationality' 
 
-class ViolationAdmin(admin.ModelAdmin):
+class ViolationChangeList(SimilaritySearchChangeList, KeysetChangeList):
+    pass
+
+
+class ViolationAdmin(SimilaritySearchAdminMixin, KeysetPaginationMixin, admin.ModelAdmin):
     form = ViolationAdminForm
     list_display = ('violation_type', 'full_name', 'company_name','company_boss_fullname','nationality', 'passport_number','date_of_birth','place_of_birth','created_at','updated_at')
     search_fields = ['violation_type', 'passport_number','violator_name', 'violator_surname','father_name', 'company_name','company_boss_fullname', 'nationality__name','nationality__code']
+    similarity_search_fields = ['violator_name', 'violator_surname', 'father_name', 'passport_number']
     autocomplete_fields = ['nationality']
     # readonly_fields = ('created_at', 'updated_at')
     list_filter = ('violation_type', CitizenshipFilter)
@@ -446,6 +414,9 @@ class ViolationAdmin(admin.ModelAdmin):
         if obj:
             form.instance = obj 
         return form
+
+    def get_changelist(self, request, **kwargs):
+        return ViolationChangeList
     
     
     class Media:
@@ -477,23 +448,29 @@ class StoredGoodImageInline(nested_admin.NestedStackedInline):
             # Create a clickable thumbnail that opens the image in full size
             return format_html(
                 '<a href="{0}" target="_blank">'
-                '<img src="{0}" style="max-height: 200px; max-width: 200px;" />'
+                '<img src="{1}" style="max-height: 200px; max-width: 200px;" />'
                 '</a>',
-                obj.image.url
+                obj.image.url,
+                get_thumbnail_url(obj.image, 'medium'),
             )
         return "No image available"
 
     image_preview.short_description = 'Image Preview'
 
-class StoredGoodInline(nested_admin.NestedTabularInline):
+class StoredGoodInline(CachedChoicesMixin, nested_admin.NestedTabularInline):
     model = StoredGood 
     fields = ('product', 'amount', 'unitofmeasurement', 'reasonforruleviolation','note')
+    cached_choice_fields = ('unitofmeasurement', 'reasonforruleviolation')
     extra = 1
     verbose_name = _("Stored Good")
     verbose_name_plural = _("Stored Goods")
     autocomplete_fields = ['product']
     inlines = [StoredGoodImageInline]
 
+    def get_queryset(self, request):
+        # Both are read by StoredGood.__str__, shown on every row
+        return super().get_queryset(request).select_related('product', 'unitofmeasurement')
+
     def get_extra(self, request, obj=None, **kwargs):
         if obj:
             return 0  
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
 from django.utils.translation import gettext_lazy as _
 
 class CustomsRegistryConfig(AppConfig):
@@ -8,3 +9,8 @@ class CustomsRegistryConfig(AppConfig):
 
     def ready(self):
         import customs_registry.signals   # Import the signals file
+        from .choices import create_cache_table
+        from .similarity import create_trigram_indexes, enable_trigram_extension
+        pre_migrate.connect(enable_trigram_extension, sender=self)
+        post_migrate.connect(create_trigram_indexes, sender=self)
+        post_migrate.connect(create_cache_table, sender=self)
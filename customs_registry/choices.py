@@ -0,0 +1,88 @@
+"""
+Cached choice lists of the small lookup tables (codexes, units, ...).
+
+Each cached list is stored under the model's current version, a token that
+the post_save and post_delete handlers in signals.py replace whenever a row
+changes, so an edited lookup shows up on the next page load without
+deleting any key. Both live in the shared ``CACHES['default']`` (a database
+table), so a change made through one worker process is seen by all of them.
+Changes that bypass the signals (``QuerySet.update``, raw SQL) show up
+after ``CHOICES_CACHE_TIMEOUT`` at the latest.
+
+CachedChoicesMixin renders the admin selects of such tables from these
+lists, instead of one query and one fresh option list per inline row.
+"""
+import time
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import translation
+
+CHOICES_CACHE_TIMEOUT = 60 * 60
+
+
+def create_cache_table(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Connected to post_migrate: create the table of the database cache backends, if missing."""
+    call_command('createcachetable', database=using, verbosity=0)
+
+
+def get_version_key(model):
+    return f'choices-version:{model._meta.label_lower}'
+
+
+def get_model_version(model):
+    version = cache.get(get_version_key(model))
+    if version is None:
+        version = bump_model_version(model)
+    return version
+
+
+def get_model_versions(models):
+    """The versions of all ``models`` with one cache read, as a dict keyed by model."""
+    keys = {get_version_key(model): model for model in models}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for model in models:
+        if model not in versions:
+            versions[model] = bump_model_version(model)
+    return versions
+
+
+def bump_model_version(model, **kwargs):
+    """Start a new version of ``model``'s cached choices; usable as a signal receiver."""
+    # A time based token rather than a counter: an evicted version never comes back
+    version = time.time_ns()
+    cache.set(get_version_key(model), version, None)
+    return version
+
+
+def get_cached_choices(model, name, build, timeout=CHOICES_CACHE_TIMEOUT):
+    """Return ``build()``, cached as ``name`` until ``model`` changes."""
+    key = f'choices:{name}:{model._meta.label_lower}:{get_model_version(model)}'
+    choices = cache.get(key)
+    if choices is None:
+        choices = build()
+        cache.set(key, choices, timeout)
+    return choices
+
+
+class CachedChoicesMixin:
+    """
+    ModelAdmin / inline mixin taking the options of the ``cached_choice_fields``
+    foreign key selects from the shared cache, so a row added through any
+    worker shows up in every worker's selects. The fields still validate
+    the submitted value against their queryset.
+    """
+    cached_choice_fields = ()
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if formfield is None or db_field.name not in self.cached_choice_fields:
+            return formfield
+        # Set before the admin wraps the widget, so the select itself gets the plain list
+        formfield.choices = get_cached_choices(
+            db_field.remote_field.model,
+            f'select:{db_field.model._meta.label_lower}.{db_field.name}:{translation.get_language()}',
+            lambda: [(str(value), label) for value, label in formfield.choices],
+        )
+        return formfield
@@ -507,7 +507,8 @@ class StoredGood(models.Model):
     updated_at = models.DateTimeField(
         auto_now=True,
         verbose_name=_('Updated At'),
-        help_text=_('The date and time when this record was last updated.')
+        help_text=_('The date and time when this record was last updated.'),
+        db_index=True  # Used by the incremental report export
     )
 
     report = models.ForeignKey('report.Report', on_delete=models.CASCADE, related_name='stored_goods')
@@ -544,6 +545,7 @@ class StoredGood(models.Model):
             raise ValidationError(_('Amount must be greater than zero.'))
         
 from django.utils.html import format_html
+from .thumbnails import get_thumbnail_url
 
 class StoredGoodImage(models.Model):
     stored_good = models.ForeignKey(
@@ -561,7 +563,7 @@ class StoredGoodImage(models.Model):
         return f"Image for {self.stored_good} - {self.description or 'No description'}"
 
     def image_tag(self):
-        return format_html('<img src="{}" style="width: 100px; height: auto;" />', self.image.url)
+        return format_html('<img src="{}" style="width: 100px; height: auto;" />', get_thumbnail_url(self.image, 'small'))
     
     image_tag.short_description = 'Image'
 
@@ -1,16 +1,23 @@
-from django.db.models.signals import pre_save,post_delete
+from django.db.models.signals import m2m_changed,pre_save,post_delete,post_save
+from django.utils import timezone
 from django.dispatch import receiver
 from PIL import Image
 from io import BytesIO
 from django.core.files.uploadedfile import InMemoryUploadedFile
 
-from report.models import AssignedTask,AssignedLetter
-from .models import Violation, StoredGoodImage
+from report.models import AssignedTask,AssignedLetter,Report
+from .models import Violation, StoredGood, StoredGoodImage
 import os
 from django.core.files.storage import default_storage
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
+from django.db.models import QuerySet
 from .models import DernewNetijesi
+from .thumbnails import delete_thumbnails, generate_thumbnails
+from .models import CustomsOfficer
+from .choices import bump_model_version
+from report.export_cache import DATA_VERSION_MODELS
+from report.search import schedule_search_document_update
 
 
 def delete_old_care_nus_file(instance):
@@ -191,6 +198,7 @@ def delete_old_image_on_update(sender, instance, **kwargs):
             # Delete the old image file from storage
             if default_storage.exists(old_image.name):
                 default_storage.delete(old_image.name)
+            delete_thumbnails(old_image.name)
 
     except sender.DoesNotExist:
         # The instance is new, so there's no old image to delete
@@ -205,4 +213,84 @@ def delete_image_on_instance_delete(sender, instance, **kwargs):
     """
     # Delete the image file from storage when the instance is deleted
     if instance.image and default_storage.exists(instance.image.name):
-        default_storage.delete(instance.image.name)
\ No newline at end of file
+        default_storage.delete(instance.image.name)
+    if instance.image:
+        delete_thumbnails(instance.image.name)
+
+
+@receiver(post_save, sender=StoredGoodImage)
+def generate_image_thumbnails(sender, instance, **kwargs):
+    """
+    Build the preview thumbnails once the (resized) image is stored, so pages
+    never have to send the full image to show a small preview.
+    """
+    if instance.image:
+        generate_thumbnails(instance.image)
+
+
+@receiver(post_delete, sender=StoredGood)
+@receiver(post_delete, sender=AssignedTask)
+def touch_report_on_child_delete(sender, instance, origin=None, **kwargs):
+    """
+    Mark the report as changed when one of its stored goods or assigned tasks
+    is deleted, so incremental exports pick the report up again.
+    """
+    # Not when the children go with the report itself (one UPDATE per child otherwise)
+    if isinstance(origin, Report) or isinstance(origin, QuerySet) and origin.model is Report:
+        return
+    Report.objects.filter(pk=instance.report_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Report)
+def update_report_search_document(sender, instance, **kwargs):
+    """Rebuild the report's full-text search document once the save is committed."""
+    schedule_search_document_update([instance.pk])
+
+
+@receiver(m2m_changed, sender=Report.administration_codexes.through)
+def update_search_document_on_codexes_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # A codex was added to or removed from reports; pk_set is None after a clear
+        schedule_search_document_update(pk_set or [])
+    else:
+        schedule_search_document_update([instance.pk])
+
+
+@receiver(post_save, sender=StoredGood)
+@receiver(post_delete, sender=StoredGood)
+def update_search_document_on_stored_good_change(sender, instance, **kwargs):
+    schedule_search_document_update([instance.report_id])
+
+
+@receiver(post_save, sender=Violation)
+def update_search_documents_on_violation_change(sender, instance, created, **kwargs):
+    if not created:
+        schedule_search_document_update(Report.objects.filter(violation=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=CustomsOfficer)
+def update_search_documents_on_officer_change(sender, instance, created, **kwargs):
+    if not created:
+        schedule_search_document_update(Report.objects.filter(customsofficer=instance).values_list('pk', flat=True))
+
+
+def bump_sender_version(sender, **kwargs):
+    """
+    Invalidate what is cached for the changed table: the choice lists of the
+    lookup tables, the facet counts of the reports and the cached exports.
+    """
+    bump_model_version(sender)
+
+
+# Every lookup table with cached choices is read by the exports as well
+for model in DATA_VERSION_MODELS:
+    post_save.connect(bump_sender_version, sender=model)
+    post_delete.connect(bump_sender_version, sender=model)
+
+
+@receiver(m2m_changed, sender=Report.administration_codexes.through)
+def bump_report_version_on_codexes_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_model_version(Report)
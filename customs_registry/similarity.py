@@ -0,0 +1,161 @@
+"""
+Typo-tolerant search on names, passport numbers and products with pg_trgm.
+
+Each searched word matches a field when it is contained in it or when it is
+similar enough to one of the field's words (``%>``, word similarity), and
+results are ranked by that similarity. Both conditions are served by the GIN
+trigram indexes created below. The other search fields are matched by
+containment only: the model's own columns through the same indexes, related
+ones (``nationality__name``) in a separate pk set that uses the foreign key
+index, so that no branch of the OR needs a sequential scan.
+
+The ``pg_trgm`` extension is enabled in a pre_migrate handler and the indexes
+are created in a post_migrate handler, as the project ships no migrations. On
+other databases than PostgreSQL the plain ``search_fields`` search is used.
+"""
+import re
+from functools import partial
+
+from django.apps import apps
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.text import smart_split, unescape_string_literal
+from rest_framework import filters
+
+# Fields with a trigram index, by model
+TRIGRAM_INDEXED_FIELDS = {
+    'customs_registry.Violation': [
+        'violator_name', 'violator_surname', 'father_name', 'passport_number',
+        'violation_type', 'company_name', 'company_boss_fullname',
+    ],
+    'customs_registry.CustomsOfficer': ['name', 'surname', 'midname'],
+    'customs_registry.Product': ['name'],
+}
+
+
+def is_supported(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == 'postgresql'
+
+
+def enable_trigram_extension(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Connected to pre_migrate; needs a database user allowed to create extensions."""
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+def create_trigram_indexes(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Connected to post_migrate."""
+    if not is_supported(using):
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for label, field_names in TRIGRAM_INDEXED_FIELDS.items():
+            table = apps.get_model(label)._meta.db_table
+            for field_name in field_names:
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {table}_{field_name}_trgm '
+                    f'ON {connection.ops.quote_name(table)} USING gin ({connection.ops.quote_name(field_name)} gin_trgm_ops)'
+                )
+
+
+def get_search_words(search_term):
+    """Split ``search_term`` like the admin does: on spaces, keeping quoted phrases together."""
+    return [unescape_string_literal(word) if word[0] in '"\'' and word[0] == word[-1] else word for word in smart_split(search_term)]
+
+
+def split_related_field(model, lookup):
+    """``'nationality__name'`` -> ``('nationality', Country, 'name')``."""
+    relation, related_field = lookup.rsplit(LOOKUP_SEP, 1)
+    related_model = model
+    for name in relation.split(LOOKUP_SEP):
+        related_model = related_model._meta.get_field(name).related_model
+    return relation, related_model, related_field
+
+
+def similarity_search(queryset, search_term, fields, extra_fields=()):
+    """
+    Filter ``queryset`` to the rows matching every word of ``search_term`` and
+    rank them by similarity, best first, in a ``search_similarity`` annotation.
+
+    ``fields`` are matched by similarity and containment, ``extra_fields``
+    by containment only. The model's own columns among them must be listed in
+    TRIGRAM_INDEXED_FIELDS.
+    """
+    model = queryset.model
+    local_fields = [field for field in extra_fields if LOOKUP_SEP not in field]
+    related_fields = [field for field in extra_fields if LOOKUP_SEP in field]
+    words = get_search_words(search_term)
+    rank = None
+    for word in words:
+        # iregex compiles to ~* on the bare column, which the trigram index serves;
+        # icontains would compile to UPPER(column) LIKE, which it does not
+        pattern = re.escape(word)
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field}__trigram_word_similar': word}) | Q(**{f'{field}__iregex': pattern})
+        for field in local_fields:
+            condition |= Q(**{f'{field}__iregex': pattern})
+        if related_fields:
+            # One pk set per related field, instead of joins OR'ed with the indexed columns
+            matches = model._default_manager.filter(condition).values('pk')
+            matches = matches.union(*[
+                model._default_manager.filter(**{f'{relation}__in': related_model._default_manager.filter(
+                    **{f'{related_field}__iregex': pattern}
+                ).values('pk')}).values('pk')
+                for relation, related_model, related_field in map(partial(split_related_field, model), related_fields)
+            ])
+            condition = Q(pk__in=matches)
+        queryset = queryset.filter(condition)
+
+        similarities = [Coalesce(TrigramWordSimilarity(word, field), 0.0) for field in fields]
+        similarity = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+        rank = similarity if rank is None else rank + similarity
+    if rank is None:
+        return queryset
+    return queryset.annotate(search_similarity=rank).order_by('-search_similarity', 'pk')
+
+
+class SimilaritySearchChangeList(ChangeList):
+    """Change list ranking search results by similarity unless the user sorts by a column."""
+
+    def get_ordering(self, request, queryset):
+        if ORDER_VAR not in self.params and 'search_similarity' in queryset.query.annotations:
+            return ['-search_similarity', '-pk']
+        return super().get_ordering(request, queryset)
+
+
+class SimilaritySearchAdminMixin:
+    """
+    Search ``similarity_search_fields`` with trigram similarity, best matches
+    first, plus the other ``search_fields`` by containment.
+
+    Also used by the admin autocompletes of the model.
+    """
+    similarity_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term and is_supported():
+            extra_fields = [field for field in self.get_search_fields(request) if field not in self.similarity_search_fields]
+            return similarity_search(queryset, search_term, self.similarity_search_fields, extra_fields), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_changelist(self, request, **kwargs):
+        return SimilaritySearchChangeList
+
+
+class SimilaritySearchFilter(filters.SearchFilter):
+    """``?search=`` with trigram similarity on the view's ``similarity_search_fields``, best matches first."""
+
+    def filter_queryset(self, request, queryset, view):
+        search_term = request.query_params.get(self.search_param, '').strip()
+        if not search_term or not is_supported():
+            return super().filter_queryset(request, queryset, view)
+        similarity_fields = getattr(view, 'similarity_search_fields', ())
+        extra_fields = [field for field in getattr(view, 'search_fields', ()) if field not in similarity_fields]
+        return similarity_search(queryset, search_term, similarity_fields, extra_fields)
@@ -1,3 +1,120 @@
+from io import BytesIO
+from unittest import skipUnless
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from report.tests import ReportFixturesMixin, TemporaryMediaRootMixin
+from .admin import ViolationAdmin
+from .models import City, StoredGoodImage, Violation
+from .similarity import similarity_search
+from .thumbnails import THUMBNAIL_CACHE_SECONDS, THUMBNAIL_SIZES, get_thumbnail_name, get_thumbnail_url
+
+
+class ThumbnailTests(ReportFixturesMixin, TemporaryMediaRootMixin, TestCase):
+
+    def create_image(self):
+        data = BytesIO()
+        Image.new('RGB', (1200, 600), 'red').save(data, format='PNG')
+        image = StoredGoodImage(stored_good=self.create_report(1).stored_goods.first())
+        image.image.save('photo.png', ContentFile(data.getvalue()))
+        return image
+
+    def test_thumbnails_are_built_when_the_image_is_saved(self):
+        image = self.create_image()
+        for size, pixels in THUMBNAIL_SIZES.items():
+            with default_storage.open(get_thumbnail_name(image.image.name, size)) as thumbnail:
+                self.assertEqual(Image.open(thumbnail).size, (pixels, pixels // 2))
+
+        image.delete()
+        self.assertFalse(default_storage.exists(get_thumbnail_name(image.image.name, 'small')))
+
+    def test_missing_thumbnails_are_built_on_first_request(self):
+        image = self.create_image()
+        thumbnail_name = get_thumbnail_name(image.image.name, 'medium')
+        default_storage.delete(thumbnail_name)
+
+        response = self.client.get(get_thumbnail_url(image.image, 'medium'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn(f'max-age={THUMBNAIL_CACHE_SECONDS}', response['Cache-Control'])
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (400, 200))
+        self.assertTrue(default_storage.exists(thumbnail_name))
+
+        self.assertEqual(self.client.get(get_thumbnail_url(image.image, 'huge')).status_code, 404)
+
+
+class ViolationSearchTests(ReportFixturesMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.merdan = Violation.objects.create(violation_type='individual', violator_name='Merdan', violator_surname='Öwezow')
+        cls.meret = Violation.objects.create(violation_type='individual', violator_name='Meret', violator_surname='Annaýew')
+
+    def search(self, term):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:customs_registry_violation_changelist'), {'q': term})
+        return list(response.context['cl'].result_list)
+
+    def test_search_finds_contained_words(self):
+        self.assertEqual(self.search('merd'), [self.merdan])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Trigram search needs PostgreSQL')
+    def test_misspelled_names_are_found_best_match_first(self):
+        self.assertEqual(self.search('Merdann Owezow')[0], self.merdan)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Trigram search needs PostgreSQL')
+    def test_related_fields_are_searched_without_scanning_the_table(self):
+        self.merdan.nationality = self.country
+        self.merdan.save()
+        self.assertEqual(self.search('Turkmen'), [self.merdan])
+
+        extra_fields = [field for field in ViolationAdmin.search_fields if field not in ViolationAdmin.similarity_search_fields]
+        queryset = similarity_search(Violation.objects.all(), 'Merdan', ViolationAdmin.similarity_search_fields, extra_fields)
+        with connection.cursor() as cursor:
+            # The tables are tiny: make the planner show whether the indexes can serve the search at all
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertNotIn(f'Seq Scan on {Violation._meta.db_table}', plan)
+        self.assertIn('Bitmap Index Scan on customs_registry_violation_violator_name_trgm', plan)
+
+
+class PaginatedInlineTests(ReportFixturesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.cities = [City.objects.create(name=f'City {number:02}', country=self.country) for number in range(45)]
+        self.url = reverse('admin:customs_registry_country_change', args=[self.country.pk])
+
+    def test_change_form_shows_one_page_of_cities(self):
+        response = self.client.get(self.url, {'cities-page': 3})
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual([form.instance for form in formset.initial_forms], self.cities[40:])
+        self.assertContains(response, '<a href="?cities-page=1">1</a>', html=True)
+
+    def test_only_the_changed_rows_of_the_page_are_saved(self):
+        response = self.client.get(self.url, {'cities-page': 2})
+        formset = response.context['inline_admin_formsets'][0].formset
+        data = {'name': self.country.name, 'code': self.country.code, '_continue': '1'}
+        data.update({f'cities-{key}': value for key, value in formset.management_form.initial.items()})
+        for index, form in enumerate(formset.initial_forms):
+            data.update({
+                f'cities-{index}-id': form.instance.pk,
+                f'cities-{index}-country': self.country.pk,
+                f'cities-{index}-name': 'Renamed' if index == 0 else form.instance.name,
+            })
 
-# Create your tests here.
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f'{self.url}?cities-page=2', data)
+        self.assertEqual(response.status_code, 302)
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE "customs_registry_city"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(City.objects.get(pk=self.cities[20].pk).name, 'Renamed')
+        self.assertEqual(City.objects.filter(country=self.country).count(), 45)
@@ -0,0 +1,79 @@
+"""
+Fixed-size JPEG previews of the stored good images.
+
+Thumbnails are generated when an image is saved and stored next to the media
+files under ``thumbnails/<size>/``. Pages link to them through the
+``thumbnail`` view, which builds any thumbnail that is still missing (images
+uploaded before thumbnails existed) and serves them with a long cache
+lifetime.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels; twice the size they are shown at, for high-density screens
+THUMBNAIL_SIZES = {
+    'small': 100,   # changelist and image_tag previews
+    'medium': 400,  # inline previews
+}
+
+THUMBNAIL_CACHE_SECONDS = 60 * 60 * 24 * 365
+
+# Only images of this folder (StoredGoodImage.image) are thumbnailed
+THUMBNAIL_SOURCE_DIR = 'stored_good_images/'
+
+
+def get_thumbnail_name(name, size):
+    return f'thumbnails/{size}/{os.path.splitext(name)[0]}.jpg'
+
+
+def get_thumbnail_url(field_file, size):
+    """URL of the ``size`` thumbnail of ``field_file``; it is built on first request if missing."""
+    return reverse('thumbnail', args=[size, field_file.name])
+
+
+def render_thumbnail(source, size):
+    """Scale the image read from ``source`` down to fit ``size`` pixels and return it as JPEG data."""
+    with Image.open(source) as image:
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=75, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def save_thumbnail(name, size, storage=default_storage):
+    """Build and store the ``size`` thumbnail of the image stored as ``name``; return its name."""
+    thumbnail_name = get_thumbnail_name(name, size)
+    with storage.open(name, 'rb') as source:
+        data = render_thumbnail(source, THUMBNAIL_SIZES[size])
+    # Replace rather than let the storage pick another name: the name is derived from the image's
+    if storage.exists(thumbnail_name):
+        storage.delete(thumbnail_name)
+    storage.save(thumbnail_name, ContentFile(data))
+    return thumbnail_name
+
+
+def generate_thumbnails(field_file):
+    """Build every thumbnail size of ``field_file``; unreadable images are logged and skipped."""
+    for size in THUMBNAIL_SIZES:
+        try:
+            save_thumbnail(field_file.name, size, field_file.storage)
+        except Exception as error:
+            logger.warning('Could not build the %s thumbnail of %s: %s', size, field_file.name, error)
+            return
+
+
+def delete_thumbnails(name, storage=default_storage):
+    for size in THUMBNAIL_SIZES:
+        thumbnail_name = get_thumbnail_name(name, size)
+        if storage.exists(thumbnail_name):
+            storage.delete(thumbnail_name)
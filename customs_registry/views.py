@@ -1,3 +1,31 @@
-from django.shortcuts import render
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_safe
 
-# Create your views here.
+from .thumbnails import (
+    THUMBNAIL_CACHE_SECONDS, THUMBNAIL_SIZES, THUMBNAIL_SOURCE_DIR, get_thumbnail_name, save_thumbnail,
+)
+
+
+@require_safe
+def thumbnail(request, size, name):
+    """
+    Serve a thumbnail of a stored good image, building it first if it is missing.
+
+    Thumbnails are named after their image and uploads nearly always get a
+    new file name, so browsers may keep them for a long time.
+    """
+    if size not in THUMBNAIL_SIZES or not name.startswith(THUMBNAIL_SOURCE_DIR) or '..' in name.split('/'):
+        raise Http404
+    thumbnail_name = get_thumbnail_name(name, size)
+    if not default_storage.exists(thumbnail_name):
+        if not default_storage.exists(name):
+            raise Http404
+        try:
+            save_thumbnail(name, size)
+        except OSError:  # Not an image Pillow can read
+            raise Http404
+    response = FileResponse(default_storage.open(thumbnail_name, 'rb'), content_type='image/jpeg')
+    patch_cache_control(response, public=True, max_age=THUMBNAIL_CACHE_SECONDS)
+    return response
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     'admin_searchable_dropdown',
     'ajax_select',
@@ -241,6 +242,32 @@ STATIC_ROOT  = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Finished admin exports are kept here and served again while the data is unchanged
+EXPORT_CACHE_DIR = BASE_DIR / 'export_cache'
+EXPORT_CACHE_MAX_SIZE = 1024 * 1024 * 1024  # 1 GB, least recently used files are removed first
+
+# Worker processes used by the export with one sheet per customs office
+EXPORT_WORKERS = os.cpu_count() or 1
+
+# Seconds after which a background export still marked as running is taken
+# for lost (its worker was stopped or killed) and marked as failed
+EXPORT_JOB_TIMEOUT = 2 * 60 * 60
+
+# Record rows, queries, peak memory and phase timings of every export as
+# ExportRun rows. Off by default: tracemalloc slows the exports down.
+EXPORT_INSTRUMENTATION = False
+
+# Shared by all worker processes, so that the cached choice lists, facet
+# counts and the version tokens invalidating them are the same in every one.
+# The table is created by `migrate`.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -23,6 +23,7 @@ from django.conf.urls.static import static
 from django.conf import settings
 from django.views.static import serve
 from django.contrib.auth.views import LoginView
+from customs_registry.views import thumbnail
 
 urlpatterns = [
     path('nested_admin/', include('nested_admin.urls')),
@@ -39,6 +40,7 @@ urlpatterns = [
 urlpatterns = [
     *i18n_patterns(*urlpatterns, prefix_default_language=True),
     path("set_language/<str:language>", set_language, name="set-language"),
+    path('thumbnails/<str:size>/<path:name>', thumbnail, name='thumbnail'),
         re_path(r'^media/(?P<path>.*)$', serve,
             {'document_root': settings.MEDIA_ROOT}),
     re_path(r'^static/(?P<path>.*)$', serve,
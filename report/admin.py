@@ -3,8 +3,11 @@ from django.contrib import admin
 import nested_admin
 from admin_searchable_dropdown.filters import AutocompleteFilter
 from customs_registry.admin import DernewNetijesiInline, StoredGoodInline
+from customs_registry.choices import CachedChoicesMixin, get_cached_choices
+from customs_registry.thumbnails import get_thumbnail_url
 from .models import AssignedLetter, AssignedTask, Report
-from customs_registry.models import CustomsOffice, CustomsPoint,AdministrationCodex
+from customs_registry.models import CustomsOffice, CustomsPoint,AdministrationCodex, StoredGood, StoredGoodImage
+from django.utils import translation
 from django.utils.translation import gettext_lazy as _
 from .models import Witness
 from django.utils.safestring import mark_safe
@@ -18,13 +21,26 @@ from .forms import AssignedTaskInlineForm, ReportAdminForm
 from django.utils.translation import pgettext_lazy
 from django.urls import reverse
 from django.contrib.admin import SimpleListFilter
-from django.db.models import Q
+from django.db.models import Count, Exists, OuterRef, Prefetch, Q
 from django.contrib.auth.models import User
 
-from .utils import export_report_to_excel, export_grouped_report
+from .utils import export_case_bundle, export_report_to_excel, export_report_with_summaries, export_grouped_report, export_reports_by_office, export_reports_to_csv, export_reports_to_parquet
+from .exporters import ReportExporter
+from .incremental import incremental_export_action
+from .jobs import background_export_action
 from django.utils.html import format_html
-
-from .models import UserProfile
+from django.urls import path
+from django.shortcuts import get_object_or_404
+from django.http import FileResponse
+from django.core.exceptions import PermissionDenied
+import os
+
+from .models import ExportJob, ExportRun, ExportWatermark, PrebuiltExport, UserProfile
+from .prebuilt import is_current
+from .facets import CachedFacetsChangeList
+from .pagination import KeysetChangeList, KeysetPaginationMixin
+from .permissions import can_edit_report, filter_editable_reports
+from .search import REPORT_SEARCH_FIELDS, is_supported as is_full_text_search_supported, search_reports
 
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'related_users_list')  # Display the user and related users in the list view
@@ -38,6 +54,182 @@ class UserProfileAdmin(admin.ModelAdmin):
 
 admin.site.register(UserProfile, UserProfileAdmin)
 
+
+class ExportRecordAdminMixin:
+    """
+    Permissions of the admins of the records kept by the exports (jobs,
+    watermarks, prebuilt files, runs): open to active staff users that also
+    hold ``required_permission``, if set. With ``owner_field`` set, users other
+    than superusers only see their own records.
+    """
+    required_permission = None
+    owner_field = None
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.owner_field and not request.user.is_superuser:
+            queryset = queryset.filter(**{self.owner_field: request.user})
+        return queryset
+
+    def has_export_record_permission(self, request):
+        user = request.user
+        return (
+            user.is_active and user.is_staff
+            and (self.required_permission is None or user.has_perm(self.required_permission))
+        )
+
+    def has_module_permission(self, request):
+        return self.has_export_record_permission(request)
+
+    def has_view_permission(self, request, obj=None):
+        return self.has_export_record_permission(request)
+
+
+class ExportJobAdmin(ExportRecordAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'export_type', 'status', 'progress_display', 'user', 'created_at', 'finished_at', 'download_link')
+    list_filter = ('status', 'export_type')
+    fields = ('export_type', 'status', 'progress_display', 'user', 'created_at', 'started_at', 'finished_at', 'download_link', 'error')
+    readonly_fields = fields
+    list_per_page = 20
+    # Users only see their own export jobs; superusers see all of them
+    owner_field = 'user'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+    def has_add_permission(self, request):
+        return False  # Jobs are created by the export actions
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:pk>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='report_exportjob_download',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, pk):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        job = get_object_or_404(self.get_queryset(request), pk=pk, status=ExportJob.STATUS_DONE)
+        return FileResponse(job.file.open('rb'), as_attachment=True, filename=os.path.basename(job.file.name))
+
+    @admin.display(description=_('Progress'))
+    def progress_display(self, obj):
+        return format_html(
+            '<progress value="{}" max="100"></progress> {}% ({}/{})',
+            obj.progress, obj.progress, obj.processed_rows, obj.total_rows
+        )
+
+    @admin.display(description=_('File'))
+    def download_link(self, obj):
+        if obj.status == ExportJob.STATUS_DONE and obj.file:
+            url = reverse('admin:report_exportjob_download', args=[obj.pk])
+            return format_html('<a href="{}">📄 {}</a>', url, _('Download'))
+        return '-'
+
+admin.site.register(ExportJob, ExportJobAdmin)
+
+
+class ExportWatermarkAdmin(ExportRecordAdminMixin, admin.ModelAdmin):
+    list_display = ('user', 'export_type', 'exported_until', 'updated_at')
+    list_filter = ('export_type',)
+    readonly_fields = ('user', 'export_type', 'selection', 'updated_at')
+    # Users only see their own watermarks; deleting one makes the next export a full one
+    owner_field = 'user'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+    def has_change_permission(self, request, obj=None):
+        return self.has_export_record_permission(request)
+
+    def has_delete_permission(self, request, obj=None):
+        return self.has_export_record_permission(request)
+
+    def has_add_permission(self, request):
+        return False  # Watermarks are set by the incremental exports
+
+admin.site.register(ExportWatermark, ExportWatermarkAdmin)
+
+
+class PrebuiltExportAdmin(ExportRecordAdminMixin, admin.ModelAdmin):
+    list_display = ('customsoffice', 'year', 'language', 'total_rows', 'built_at', 'download_link')
+    list_filter = ('year', 'language', 'customsoffice')
+    fields = ('customsoffice', 'year', 'language', 'total_rows', 'built_at', 'download_link')
+    readonly_fields = fields
+    list_per_page = 50
+    # The workbooks hold every report of an office
+    required_permission = 'report.view_report'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('customsoffice')
+
+    def has_add_permission(self, request):
+        return False  # Built by the prebuild_office_exports command
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<int:pk>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='report_prebuiltexport_download',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, pk):
+        """Serve the prebuilt file if the office's data is unchanged, otherwise build the workbook now."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        prebuilt = get_object_or_404(self.get_queryset(request), pk=pk)
+        if is_current(prebuilt):
+            return FileResponse(prebuilt.file.open('rb'), as_attachment=True, filename=os.path.basename(prebuilt.file.name))
+        with translation.override(prebuilt.language):
+            return ReportExporter().response(prebuilt.get_queryset(), user=request.user)
+
+    @admin.display(description=_('File'))
+    def download_link(self, obj):
+        url = reverse('admin:report_prebuiltexport_download', args=[obj.pk])
+        return format_html('<a href="{}">📄 {}</a>', url, _('Download'))
+
+admin.site.register(PrebuiltExport, PrebuiltExportAdmin)
+
+
+class ExportRunAdmin(ExportRecordAdminMixin, admin.ModelAdmin):
+    list_display = (
+        'name', 'user', 'rows', 'total_time', 'query_count', 'query_time', 'peak_memory_display',
+        'row_building_time', 'styling_time', 'writing_time', 'saving_time', 'created_at',
+    )
+    list_filter = ('name',)
+    date_hierarchy = 'created_at'
+    list_per_page = 50
+    # Users only see the runs of their own exports; superusers see all of them
+    owner_field = 'user'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+    def has_add_permission(self, request):
+        return False  # Recorded by the instrumented exports
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description=_('Peak memory (MB)'), ordering='peak_memory')
+    def peak_memory_display(self, obj):
+        return f'{obj.peak_memory / 1024 / 1024:.1f}'
+
+admin.site.register(ExportRun, ExportRunAdmin)
+
 class WitnessInline(nested_admin.NestedTabularInline): 
     model = Witness
     fields = ('fullname', 'address')  
@@ -52,9 +244,10 @@ class WitnessInline(nested_admin.NestedTabularInline):
             return 0 
         return 1 
 
-class AssignedLetterInline(nested_admin.NestedTabularInline): 
+class AssignedLetterInline(CachedChoicesMixin, nested_admin.NestedTabularInline): 
     model = AssignedLetter
     fields = ('letterforaction','number', 'date', 'assignedtask','care_nusga','hatyn_nusgasy_link')
+    cached_choice_fields = ('letterforaction',)
     extra = 1  
     verbose_name = _("Assigned Letter")
     verbose_name_plural = _("Assigned Letters")
@@ -67,6 +260,10 @@ class AssignedLetterInline(nested_admin.NestedTabularInline):
         return "No file uploaded"
     
     hatyn_nusgasy_link.short_description = "Çäre nusgasy PDF"
+
+    def get_queryset(self, request):
+        # Read by AssignedLetter.__str__, shown on every row
+        return super().get_queryset(request).select_related('assignedtask__workgroup')
     
   
 
@@ -76,9 +273,10 @@ class AssignedLetterInline(nested_admin.NestedTabularInline):
             return 0  
         return 1  
 
-class AssignedTaskInline(nested_admin.NestedStackedInline): 
+class AssignedTaskInline(CachedChoicesMixin, nested_admin.NestedStackedInline): 
     model = AssignedTask
     fields = ('workgroup','karar_date', 'salnan_jerime', 'tolenen_manat','trb','trb_date','bilermen_nusga','hatyn_nusgasy_link')
+    cached_choice_fields = ('workgroup',)
     extra = 1  
     verbose_name = _("Assigned Task")
     verbose_name_plural = _("Assigned Tasks")
@@ -94,6 +292,10 @@ class AssignedTaskInline(nested_admin.NestedStackedInline):
         return "No file uploaded"
     
     hatyn_nusgasy_link.short_description = "Bilermen nusgasy PDF"
+
+    def get_queryset(self, request):
+        # Read by AssignedTask.__str__, shown on every row
+        return super().get_queryset(request).select_related('workgroup')
     
   
     def get_extra(self, request, obj=None, **kwargs):       
@@ -139,23 +341,71 @@ class AdministrationCodexFilter(admin.SimpleListFilter):
     parameter_name = "administration_codexes"
 
     def lookups(self, request, model_admin):
-        """Return a list of tuples for the filter options."""
-        codexes = AdministrationCodex.objects.all()
-        return [(codex.id, codex.name) for codex in codexes]
+        """Return a list of tuples for the filter options, cached until a codex changes."""
+        return get_cached_choices(
+            AdministrationCodex,
+            'report-filter',
+            lambda: list(AdministrationCodex.objects.values_list('id', 'name')),
+        )
 
     def queryset(self, request, queryset):
         """Filter the queryset based on the selected codex(es)."""
         if self.value():
-            # Filter for reports containing the selected codex
-            return queryset.filter(administration_codexes__id=self.value()).distinct()
+            # Reports containing the selected codex; EXISTS instead of a join, so no DISTINCT is needed
+            links = Report.administration_codexes.through.objects.filter(
+                report=OuterRef('pk'), administrationcodex=self.value(),
+            )
+            return queryset.filter(Exists(links))
+        return queryset
+
+class EditableReportFilter(admin.SimpleListFilter):
+    title = _('Editable by me')
+    parameter_name = 'editable'
+
+    def lookups(self, request, model_admin):
+        return [('yes', _('Yes'))]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return filter_editable_reports(request, queryset)
         return queryset
 
-class ReportAdmin(nested_admin.NestedModelAdmin):    
+
+class ReportChangeList(CachedFacetsChangeList, KeysetChangeList):
+    """Change list that loads the relations rendered by the list columns together with the rows."""
+
+    def get_results(self, request):
+        # Only the listed rows; the admin actions build their own queryset with cl.get_queryset()
+        self.queryset = self.model_admin.get_list_queryset(self.queryset)
+        super().get_results(request)
+
+
+class ReportAdmin(KeysetPaginationMixin, nested_admin.NestedModelAdmin):    
     
     inlines = [StoredGoodInline, WitnessInline, AssignedTaskInline]
+    # Newest first, as Report.Meta.ordering, served by the report_created_desc index
+    keyset_fields = ('created_at', 'id')
+    virtual_show_all = True
+    # Counts beside the filters; cached by ReportChangeList
+    show_facets = admin.ShowFacets.ALWAYS
         
 
-    actions = [export_report_to_excel,export_grouped_report]
+    actions = [
+        export_report_to_excel,
+        export_report_with_summaries,
+        export_reports_by_office,
+        export_grouped_report,
+        export_reports_to_csv,
+        export_reports_to_parquet,
+        export_case_bundle,
+        incremental_export_action(ReportExporter, 'reports', _('Export reports changed since my last export to Excel')),
+        background_export_action('reports', _('Export selected reports to Excel in the background')),
+        background_export_action('reports_with_summaries', _('Export selected reports to Excel with summary sheets in the background')),
+        background_export_action('reports_by_office', _('Export selected reports to Excel, one sheet per customs office, in the background')),
+        background_export_action('reports_csv', _('Export selected reports to CSV in the background')),
+        background_export_action('reports_parquet', _('Export selected reports to Parquet in the background')),
+        background_export_action('grouped_reports', _('1+ saklananlar in the background')),
+    ]
  
     # Dine 'export_grouped_report' belli ulanyjylar un
     def get_actions(self, request):
@@ -167,6 +417,7 @@ class ReportAdmin(nested_admin.NestedModelAdmin):
 
         if request.user.username not in allowed_usernames:
             actions.pop('export_grouped_report', None)
+            actions.pop('grouped_reports_in_background', None)
 
         return actions
 
@@ -176,31 +427,60 @@ class ReportAdmin(nested_admin.NestedModelAdmin):
         """
         return super().get_queryset(request)
 
+    def get_changelist(self, request, **kwargs):
+        return ReportChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search the reports' full-text documents on PostgreSQL: no joins and no duplicate rows."""
+        if search_term and is_full_text_search_supported():
+            return search_reports(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def get_list_queryset(self, queryset):
+        """
+        Join or prefetch everything the list_display columns read, so a page
+        of reports costs the same number of queries however many rows it shows.
+        """
+        return queryset.select_related(
+            'customspoint',
+            'violation',
+            'customsofficer__militaryname',
+            'customsofficer__position',
+            'from_country',
+            'to_country',
+            'customsoffice',
+            'basisfordiscovery',
+            'methodofdiscovery',
+            'user',
+        ).prefetch_related(
+            Prefetch(
+                'stored_goods',
+                queryset=StoredGood.objects.select_related('product', 'unitofmeasurement').annotate(
+                    image_count=Count('images'),
+                ).prefetch_related(
+                    # Sliced prefetches are limited per good with a ROW_NUMBER() window
+                    Prefetch(
+                        'images',
+                        queryset=StoredGoodImage.objects.order_by('pk')[:self.max_stored_good_images],
+                        to_attr='preview_images',
+                    ),
+                ),
+            ),
+            Prefetch('assigned_tasks', queryset=AssignedTask.objects.select_related('workgroup')),
+            'administration_codexes',
+        )
+
 
     def has_change_permission(self, request, obj=None):
         """
         Allow users to update only their own records or records related to them.
         Superusers can update all records.
         """
-        if request.user.is_superuser:
-            return True  # Superusers can edit all records
-        
         if obj is None:  # Allows accessing the change list page
             return True
-        
-        # Check if the user is editing their own record
-        if obj.user == request.user:
-            return True
-        
-        # Check if the user is editing a record related to them through the UserProfile model
-        try:
-            user_profile = UserProfile.objects.get(user=request.user)
-            if obj.user in user_profile.related_users.all():
-                return True
-        except UserProfile.DoesNotExist:
-            return False  # If the user doesn't have a profile, they can't edit related users' records
-        
-        return False
+
+        # The editable users are looked up once per request, however often this is called
+        return can_edit_report(request, obj)
 
     def save_model(self, request, obj, form, change):
         """
@@ -227,6 +507,8 @@ class ReportAdmin(nested_admin.NestedModelAdmin):
                     BasisForDiscoveryFilter,
                     MethodOfDiscoveryFilter,
                     CustomsOfficerFilter,
+                    AdministrationCodexFilter,
+                    EditableReportFilter,
                    )
     
     
@@ -252,52 +534,13 @@ class ReportAdmin(nested_admin.NestedModelAdmin):
                     'updated_at',
                     'get_username',
                     )
-    search_fields = (
-                    'ud_belgi',
-                    'vehicle_brand__name',
-                    'transport_company__name',
-                    'protocol_number', 
-                    'ish_toplum_number',
-                    'report_date',
-                    'customsoffice__name', 
-                    'customspoint__name',
-                    'violation__violation_type',
-                    'violation__company_name',
-                    'violation__phone',
-                    'violation__violator_name',
-                    'violation__violator_surname',
-                    'violation__father_name',
-                    'violation__date_of_birth',
-                    'violation__passport_number',
-                    'violation__nationality__name',
-                    'violation__nationality__code',
-                    'entry_exit_transit',
-                    'from_country__name',
-                    'from_country__code',
-                    'to_country__name',
-                    'to_country__code',
-                    'customsofficer__name',
-                    'customsofficer__surname',
-                    'customsofficer__midname',
-                    'customsofficer__position__name',
-                    'customsofficer__militaryname__name',
-                    'basisfordiscovery__name', 
-                    'methodofdiscovery__name',
-                    # 'reasonforruleviolation__name',
-                    'administration_codexes__name',
-                    'language_of_work_conducted',
-                    'carnumber',
-                    'stored_goods__product__name',
-                    'stored_goods__amount',  # Search by amount
-                    'stored_goods__unitofmeasurement__name',  # Search by unit of measurement
-                    'stored_goods__note',  # Search by note (optional)
-                    'user__username'
-                    )
+    search_fields = REPORT_SEARCH_FIELDS
     
     readonly_fields = ('created_at', 'updated_at','get_username')
     filter_horizontal = ('administration_codexes',) 
     autocomplete_fields  = ['customsofficer','violation','from_country','to_country','transport_company'] 
     list_per_page = 5  # Display 100 items per page
+    max_stored_good_images = 3  # Images shown per stored good in the list
     list_max_show_all = 100000  # Allow up to 500 items for "Show all"
 
     
@@ -322,23 +565,22 @@ class ReportAdmin(nested_admin.NestedModelAdmin):
     def stored_goods_display(self, obj):
         stored_goods = obj.stored_goods.all()  # Fetch associated stored goods
         goods_list = []
-        max_images = 3  # Set the maximum number of images to display
 
         for stored_good in stored_goods:
-            # Fetch only a limited number of images
-            images = stored_good.images.all()[:max_images]
+            # First images and the image count come with the page, see get_list_queryset()
+            images = stored_good.preview_images
 
             # Create a string for images with anchor tags
             images_html = ''.join([
                 f'<a href="{image.image.url}" target="_blank">'
-                f'<img src="{image.image.url}" style="width:50px; height:50px; margin:2px; border:1px solid #ccc; border-radius:4px;" '
+                f'<img src="{get_thumbnail_url(image.image, "small")}" style="width:50px; height:50px; margin:2px; border:1px solid #ccc; border-radius:4px;" '
                 f'title="{stored_good.product.name}" /></a>' 
                 for image in images
             ])
             
             # If there are more images than the limit, add a "more images" link
-            if stored_good.images.count() > max_images:
-                images_html += f' <a href="#" title="View more images">+{stored_good.images.count() - max_images} more</a>'
+            if stored_good.image_count > len(images):
+                images_html += f' <a href="#" title="View more images">+{stored_good.image_count - len(images)} more</a>'
             
             # Format the string for the stored good
             goods_list.append(
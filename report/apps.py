@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 from django.utils.translation import gettext_lazy as _
 
 
@@ -7,4 +8,8 @@ class ReportConfig(AppConfig):
     name = 'report'
     verbose_name = _('Reports')
 
+    def ready(self):
+        from .search import create_search_index
+        post_migrate.connect(create_search_index, sender=self)
+
     
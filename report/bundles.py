@@ -0,0 +1,120 @@
+"""
+Case bundles: a ZIP with the reports workbook and every file attached to the reports.
+
+The archive is written on the fly into a small buffer that is handed to the
+response after every chunk, so it is never held in memory or written to disk
+as a whole. Attached PDFs and images are already compressed and are stored
+as they are.
+"""
+import os
+import zipfile
+from datetime import datetime
+
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils.text import get_valid_filename
+
+from customs_registry.models import StoredGood
+from .export_cache import cached_export
+from .exporters import EXPORT_CHUNK_SIZE, EXPORT_STREAM_BLOCK_SIZE, ReportExporter
+from .models import AssignedTask
+
+
+class StreamBuffer:
+    """Write-only file object whose contents are collected and emptied by the response."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_bundle_queryset(queryset):
+    """Prefetch every file field of the selected reports."""
+    return queryset.only('pk', 'protocol_number').prefetch_related(
+        Prefetch('stored_goods', queryset=StoredGood.objects.only('pk', 'report_id').prefetch_related('images')),
+        Prefetch(
+            'assigned_tasks',
+            queryset=AssignedTask.objects.only('pk', 'report_id', 'bilermen_nusga').prefetch_related(
+                'assigned_letters', 'dernewin_netijesi'
+            )
+        ),
+    )
+
+
+def get_report_files(report):
+    """Yield ``(archive path, field file)`` for every file attached to ``report``."""
+    folder = get_valid_filename(f'{report.pk}_{report.protocol_number or ""}'.rstrip('_'))
+
+    for good in report.stored_goods.all():
+        for image in good.images.all():
+            if image.image:
+                yield f'{folder}/stored_goods/{good.pk}/{image.pk}_{os.path.basename(image.image.name)}', image.image
+
+    for task in report.assigned_tasks.all():
+        task_folder = f'{folder}/assigned_tasks/{task.pk}'
+        if task.bilermen_nusga:
+            yield f'{task_folder}/bilermen_nusga_{os.path.basename(task.bilermen_nusga.name)}', task.bilermen_nusga
+        for letter in task.assigned_letters.all():
+            if letter.care_nusga:
+                yield f'{task_folder}/letters/{letter.pk}_{os.path.basename(letter.care_nusga.name)}', letter.care_nusga
+        for netije in task.dernewin_netijesi.all():
+            if netije.hatyn_nusgasy:
+                yield f'{task_folder}/dernew/{netije.pk}_{os.path.basename(netije.hatyn_nusgasy.name)}', netije.hatyn_nusgasy
+
+
+def write_entry(archive, buffer, name, source, size, compress_type):
+    """Copy ``source`` into the archive, yielding the compressed bytes block by block."""
+    info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = compress_type
+    info.file_size = size
+    with archive.open(info, 'w') as entry:
+        while True:
+            block = source.read(EXPORT_STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            entry.write(block)
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def iter_case_bundle(queryset):
+    """Yield the ZIP archive of the selected reports piece by piece."""
+    buffer = StreamBuffer()
+    missing = []
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        exporter = ReportExporter()
+        with cached_export(exporter.get_cache_name('xlsx'), queryset, 'xlsx', lambda output: exporter.write(queryset, output)) as workbook:
+            size = workbook.seek(0, os.SEEK_END)
+            workbook.seek(0)
+            yield from write_entry(archive, buffer, 'reports.xlsx', workbook, size, zipfile.ZIP_DEFLATED)
+
+        for report in get_bundle_queryset(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            for name, field_file in get_report_files(report):
+                try:
+                    source = field_file.storage.open(field_file.name, 'rb')
+                except FileNotFoundError:
+                    missing.append(field_file.name)
+                    continue
+                with source:
+                    yield from write_entry(archive, buffer, name, source, field_file.size, zipfile.ZIP_STORED)
+
+        if missing:
+            archive.writestr('missing_files.txt', '\n'.join(missing) + '\n')
+    yield buffer.pop()
+
+
+def case_bundle_response(queryset):
+    response = StreamingHttpResponse(iter_case_bundle(queryset), content_type='application/zip')
+    response['Content-Disposition'] = f"attachment; filename=reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return response
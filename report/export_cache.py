@@ -0,0 +1,167 @@
+"""
+On-disk cache of finished export files.
+
+A cached file is only reused for the same query, language and data version, so
+any change to the exported data produces a new file. The data version is made
+of the version tokens (customs_registry/choices.py) of every model the exports
+read, which the signals replace whenever one of their rows changes. The
+directory is kept under ``EXPORT_CACHE_MAX_SIZE`` by removing the least
+recently used files.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Count, Max
+from django.utils import translation
+
+from customs_registry.choices import get_model_versions
+from customs_registry.models import (
+    AdministrationCodex, BasisForDiscovery, Country, CustomsOffice, CustomsOfficer, CustomsPoint,
+    LettersForAction, MethodOfDiscovery, MilitaryName, Position, Product, ReasonForRuleViolation,
+    StoredGood, TransportCompanyName, UnitOfMeasurement, VehicleBrand, Violation, Workgroup,
+)
+from .models import AssignedLetter, AssignedTask, Report, Witness
+
+
+# Models whose rows end up in the report exports, the looked up names included.
+# A change to the codexes of a report bumps the version of Report.
+DATA_VERSION_MODELS = [
+    Report, Witness, AssignedTask, AssignedLetter, StoredGood, Violation,
+    CustomsOffice, CustomsPoint, CustomsOfficer, Position, MilitaryName, Country, Product,
+    UnitOfMeasurement, ReasonForRuleViolation, Workgroup, LettersForAction, AdministrationCodex,
+    BasisForDiscovery, MethodOfDiscovery, VehicleBrand, TransportCompanyName,
+]
+
+
+def get_data_version(models=DATA_VERSION_MODELS):
+    """The version tokens of every model, as one string; costs a single cache read."""
+    versions = get_model_versions(models)
+    return '|'.join(f'{model._meta.label}:{versions[model]}' for model in models)
+
+
+def get_report_data_version(queryset):
+    """
+    Like ``get_data_version`` but limited to the reports of ``queryset`` and
+    the rows that hang off them, so changes to other reports don't count.
+
+    Those rows are versioned by their latest ``updated_at`` and their count,
+    the looked up names by their version tokens.
+    """
+    report_ids = queryset.order_by().values('pk')
+    querysets = [
+        queryset.order_by(),
+        Witness.objects.filter(report__in=report_ids),
+        AssignedTask.objects.filter(report__in=report_ids),
+        AssignedLetter.objects.filter(assignedtask__report__in=report_ids),
+        StoredGood.objects.filter(report__in=report_ids),
+        Violation.objects.filter(pk__in=queryset.order_by().values('violation')),
+    ]
+    parts = []
+    for related in querysets:
+        version = related.order_by().aggregate(updated_at=Max('updated_at'), count=Count('pk'))
+        updated_at = version['updated_at'].isoformat() if version['updated_at'] else ''
+        parts.append(f"{related.model._meta.label}:{updated_at}:{version['count']}")
+
+    # The codex links have no updated_at, but changing them creates new ids or changes the count
+    codexes = Report.administration_codexes.through.objects.filter(report__in=report_ids).aggregate(
+        latest=Max('pk'), count=Count('pk'),
+    )
+    parts.append(f"codexes:{codexes['latest'] or ''}:{codexes['count']}")
+
+    scoped_models = {related.model for related in querysets}
+    parts.append(get_data_version([model for model in DATA_VERSION_MODELS if model not in scoped_models]))
+    return '|'.join(parts)
+
+
+def get_cache_key(name, queryset, data_version=None):
+    """Fingerprint of an export: its name, the SQL and parameters, the language and the data version."""
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        # queryset.none() and filters that can never match
+        sql, params = '', ()
+    if data_version is None:
+        data_version = get_data_version()
+    fingerprint = '\n'.join([name, sql, repr(params), translation.get_language() or '', data_version])
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def get_cache_dir():
+    cache_dir = settings.EXPORT_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_cached_file(key, extension):
+    """Open the cached file for ``key`` and mark it as recently used, or return None."""
+    path = os.path.join(get_cache_dir(), f'{key}.{extension}')
+    try:
+        output = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    # The modification time doubles as the last access time for eviction
+    os.utime(path)
+    return output
+
+
+def store_file(key, extension, write):
+    """
+    Build a file with ``write(output)``, add it to the cache and return it opened.
+
+    The file is written under a temporary name and renamed when complete, so
+    concurrent requests never read a half-written export.
+    """
+    cache_dir = get_cache_dir()
+    path = os.path.join(cache_dir, f'{key}.{extension}')
+    output = tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False)
+    try:
+        write(output)
+        output.close()
+        os.replace(output.name, path)
+    except BaseException:
+        output.close()
+        os.remove(output.name)
+        raise
+
+    evict(keep=path)
+    return open(path, 'rb')
+
+
+def evict(keep=None):
+    """Remove the least recently used files until the cache fits in ``EXPORT_CACHE_MAX_SIZE``."""
+    cache_dir = get_cache_dir()
+    entries = []
+    for entry in os.scandir(cache_dir):
+        # Skip files that are still being written
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total_size <= settings.EXPORT_CACHE_MAX_SIZE:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def cached_export(name, queryset, extension, write):
+    """
+    Return an open file with the export of ``queryset``.
+
+    ``write(output)`` is only called when no file for the same query, language
+    and data version is cached yet.
+    """
+    key = get_cache_key(name, queryset)
+    output = get_cached_file(key, extension)
+    if output is None:
+        output = store_file(key, extension, write)
+    return output
@@ -0,0 +1,712 @@
+"""
+Declarative exports shared by every admin that offers an Excel or CSV download.
+
+An exporter lists its columns once; the column specs are compiled into a single
+row-building function, styles are registered once per workbook as named styles
+and column widths are measured while the rows are written.
+"""
+import csv
+import io
+import os
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+from operator import itemgetter
+from wsgiref.util import FileWrapper
+
+from django.db.models import Count, F, Prefetch, Sum
+from django.db.models.functions import TruncMonth
+from django.http import StreamingHttpResponse
+from django.utils.timezone import localtime
+from django.utils.translation import gettext, gettext_lazy as _
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import TIME_FORMATS
+from openpyxl.styles import Alignment, Border, Color, Font, GradientFill, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from customs_registry.models import AdministrationCodex, StoredGood
+from .export_cache import cached_export
+from .instrumentation import get_metrics, instrument
+from .models import AssignedLetter, AssignedTask
+
+
+# Rows are pulled from the database in chunks of this size when exporting
+EXPORT_CHUNK_SIZE = 500
+
+# Size of the chunks used to stream a finished file back to the browser
+EXPORT_STREAM_BLOCK_SIZE = 64 * 1024
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_CONTENT_TYPE = 'text/csv'
+
+CONTENT_TYPES = {
+    'xlsx': XLSX_CONTENT_TYPE,
+    'csv': CSV_CONTENT_TYPE,
+}
+
+THIN_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+
+
+def stream_file(output, filename, content_type=XLSX_CONTENT_TYPE):
+    """
+    Stream an open temporary file back to the browser in chunks.
+
+    The file is closed, and therefore removed, once the response is finished.
+    """
+    size = output.seek(0, os.SEEK_END)
+    output.seek(0)
+
+    response = StreamingHttpResponse(
+        FileWrapper(output, EXPORT_STREAM_BLOCK_SIZE),
+        content_type=content_type
+    )
+    response['Content-Length'] = size
+    response['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
+def styled_cell(sheet, value, style=None):
+    """
+    Build a cell that already carries a named style.
+
+    The style is applied before the value so that dates and datetimes still
+    get their number format from openpyxl.
+    """
+    cell = WriteOnlyCell(sheet)
+    if style is not None:
+        cell.style = style
+    cell.value = value
+    return cell
+
+
+def compile_accessor(value):
+    """
+    Turn a column value spec into a function of one row.
+
+    ``value`` is either a callable or a ``__`` separated attribute path; a path
+    stops at the first ``None`` it meets instead of raising.
+    """
+    if callable(value):
+        return value
+
+    names = value.split('__')
+    if len(names) == 1:
+        name = names[0]
+        return lambda row: getattr(row, name)
+
+    def accessor(row):
+        for name in names:
+            row = getattr(row, name)
+            if row is None:
+                return None
+        return row
+    return accessor
+
+
+class Column:
+    """
+    One exported column.
+
+    ``width`` fixes the column width; when it is left out the width is measured
+    from the exported values. ``style`` names a style from the exporter's
+    ``styles`` and overrides the exporter's row style for this column.
+    """
+
+    def __init__(self, header, value, width=None, style=None):
+        self.header = header
+        self.value = value
+        self.width = width
+        self.style = style
+
+
+class Exporter:
+    """
+    Base class for the admin exports.
+
+    Subclasses declare ``columns`` and, when one object spans several rows or
+    needs a query plan, override ``get_queryset`` and ``get_rows``.
+    """
+
+    sheet_title = 'Export'
+    filename = 'export'
+    columns = []
+
+    # Named style name -> NamedStyle keyword arguments
+    styles = {}
+    header_style = None
+    # Applied in turn to consecutive objects, e.g. alternating row colours
+    row_styles = (None,)
+
+    header_height = None
+    freeze_panes = None
+    auto_filter = False
+    width_padding = 2
+
+    # Keep finished files in the export cache and serve them again while the
+    # query, the language and the exported data are unchanged
+    cache = False
+
+    # Exporters for extra sheets computed from the same queryset. They share
+    # the workbook's named styles and, as the workbook may be write-only,
+    # need a fixed width for every column.
+    summaries = []
+
+    def get_queryset(self, queryset):
+        return queryset
+
+    def iter_objects(self, queryset, progress=None):
+        """Read ``queryset`` in chunks, reporting progress once per chunk of objects."""
+        for number, obj in enumerate(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE), start=1):
+            yield number, obj
+            if progress and number % EXPORT_CHUNK_SIZE == 0:
+                progress(number)
+
+    def get_rows(self, queryset, progress=None):
+        """Yield ``(object_number, row)`` pairs, one pair per output row."""
+        return self.iter_objects(queryset, progress)
+
+    def get_headers(self):
+        return [str(column.header) for column in self.columns]
+
+    def get_filename(self, file_format):
+        return f"{self.filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{file_format}"
+
+    def compile_row(self):
+        """Build one function that turns a row into the list of its column values."""
+        accessors = [compile_accessor(column.value) for column in self.columns]
+
+        def build_row(row):
+            return [accessor(row) for accessor in accessors]
+        return build_row
+
+    def iter_values(self, queryset, progress=None):
+        """Yield ``(object_number, values)`` for every output row."""
+        build_row = self.compile_row()
+        for number, row in self.get_rows(self.get_queryset(queryset), progress):
+            yield number, build_row(row)
+
+    @property
+    def measure_widths(self):
+        return any(column.width is None for column in self.columns)
+
+    def create_workbook(self):
+        """
+        Create an empty workbook with the exporter's named styles registered.
+
+        Write-only worksheets need every column width before the first row, so
+        exports that measure their widths from the data use a regular workbook.
+        """
+        workbook = Workbook(write_only=not self.measure_widths)
+        if not workbook.write_only:
+            workbook.remove(workbook.active)
+
+        self.named_styles = {name: NamedStyle(name=name, **spec) for name, spec in self.styles.items()}
+        for style in self.named_styles.values():
+            workbook.add_named_style(style)
+        return workbook
+
+    def register_cell_styles(self, sheet):
+        """
+        Register every style and number format combination the export can use.
+
+        Cell formats are otherwise numbered in the order they are first met, so
+        registering them up front gives every workbook written by this exporter
+        the same style table, whatever rows it holds.
+        """
+        for style in [None, *self.named_styles.values()]:
+            for number_format in ['General', *TIME_FORMATS.values()]:
+                cell = styled_cell(sheet, None, style)
+                cell.number_format = number_format
+                # Reading style_id adds the combination to the workbook's style table
+                cell.style_id
+
+    def write_sheet(self, workbook, queryset, progress=None, title=None):
+        """Add a worksheet with the export of ``queryset`` and return the number of rows written."""
+        sheet = workbook.create_sheet(title=str(title or self.sheet_title))
+        self.register_cell_styles(sheet)
+
+        header_style = self.named_styles.get(self.header_style)
+        row_styles = [self.named_styles.get(name) for name in self.row_styles]
+        column_styles = [self.named_styles.get(column.style) for column in self.columns]
+
+        metrics = get_metrics()
+        headers = self.get_headers()
+        widths = [len(header) for header in headers]
+
+        if not self.measure_widths:
+            for index, column in enumerate(self.columns, start=1):
+                sheet.column_dimensions[get_column_letter(index)].width = column.width
+        if self.header_height:
+            sheet.row_dimensions[1].height = self.header_height
+        if self.freeze_panes:
+            sheet.freeze_panes = self.freeze_panes
+
+        sheet.append([styled_cell(sheet, header, header_style) for header in headers])
+        last_row = 1
+
+        for number, values in metrics.timed_iter('row_building', self.iter_values(queryset, progress)):
+            row_style = row_styles[number % len(row_styles)]
+            with metrics.timer('styling'):
+                cells = [
+                    styled_cell(sheet, value, column_style or row_style)
+                    for value, column_style in zip(values, column_styles)
+                ]
+            with metrics.timer('writing'):
+                sheet.append(cells)
+            last_row += 1
+            if self.measure_widths:
+                for index, value in enumerate(values):
+                    if value:
+                        widths[index] = max(widths[index], len(str(value)))
+
+        if self.measure_widths:
+            for index, column in enumerate(self.columns, start=1):
+                width = column.width or widths[index - 1] + self.width_padding
+                sheet.column_dimensions[get_column_letter(index)].width = width
+
+        if self.auto_filter:
+            sheet.auto_filter.ref = self.get_auto_filter_ref(last_row)
+
+        metrics.add_rows(last_row - 1)
+        return last_row
+
+    def get_auto_filter_ref(self, last_row):
+        return f"A1:{get_column_letter(len(self.columns))}{last_row}"
+
+    def write_xlsx(self, queryset, output, progress=None):
+        workbook = self.create_workbook()
+        self.write_sheet(workbook, queryset, progress)
+        for summary_class in self.summaries:
+            summary = summary_class()
+            summary.named_styles = self.named_styles
+            summary.write_sheet(workbook, queryset)
+        with get_metrics().timer('saving'):
+            workbook.save(output)
+
+    def write_csv(self, queryset, output, progress=None):
+        # utf-8-sig so that Excel opens Turkmen and Russian text correctly
+        metrics = get_metrics()
+        text = io.TextIOWrapper(output, encoding='utf-8-sig', newline='')
+        writer = csv.writer(text)
+        writer.writerow(self.get_headers())
+        rows = 0
+        for number, values in metrics.timed_iter('row_building', self.iter_values(queryset, progress)):
+            with metrics.timer('writing'):
+                writer.writerow(['' if value is None else value for value in values])
+            rows += 1
+        with metrics.timer('saving'):
+            text.flush()
+            text.detach()
+        metrics.add_rows(rows)
+
+    def write(self, queryset, output, file_format='xlsx', progress=None):
+        writers = {
+            'xlsx': self.write_xlsx,
+            'csv': self.write_csv,
+        }
+        writers[file_format](queryset, output, progress=progress)
+
+    def get_cache_name(self, file_format):
+        return f'{type(self).__module__}.{type(self).__qualname__}.{file_format}'
+
+    def response(self, queryset, file_format='xlsx', user=None):
+        """Build the export in a temporary file, or take it from the export cache, and stream it back."""
+        with instrument(f'{type(self).__name__}.{file_format}', user):
+            if self.cache:
+                output = cached_export(
+                    self.get_cache_name(file_format), queryset, file_format,
+                    lambda output: self.write(queryset, output, file_format),
+                )
+            else:
+                output = tempfile.TemporaryFile()
+                self.write(queryset, output, file_format)
+        return stream_file(output, self.get_filename(file_format), CONTENT_TYPES[file_format])
+
+
+def format_date(value):
+    return value.strftime('%d.%m.%Y') if value else ''
+
+
+def naive_localtime(value):
+    # Excel has no time zones
+    return localtime(value).replace(tzinfo=None) if value else None
+
+
+def get_report_export_queryset(queryset):
+    """
+    Attach the fixed query plan used by the report export.
+
+    Every relation the export reads is either joined or prefetched here, so
+    each chunk of reports costs the same handful of queries however many
+    reports are exported.
+    """
+    return queryset.select_related(
+        'customsoffice',
+        'customspoint',
+        'violation__nationality',
+        'customsofficer__position',
+        'customsofficer__militaryname',
+        'vehicle_brand',
+        'transport_company',
+        'basisfordiscovery',
+        'methodofdiscovery',
+        'from_country',
+        'to_country',
+    ).prefetch_related(
+        Prefetch('administration_codexes', queryset=AdministrationCodex.objects.only('id', 'name')),
+        'witnesses',
+        Prefetch(
+            'assigned_tasks',
+            queryset=AssignedTask.objects.select_related('workgroup').prefetch_related(
+                Prefetch('assigned_letters', queryset=AssignedLetter.objects.select_related('letterforaction'))
+            )
+        ),
+        Prefetch(
+            'stored_goods',
+            queryset=StoredGood.objects.select_related('product', 'unitofmeasurement', 'reasonforruleviolation')
+        ),
+    )
+
+
+def get_grouped_report_queryset(queryset):
+    """Query plan for the grouped export: one ordered query plus a few prefetches."""
+    return queryset.select_related(
+        'violation__nationality',
+        'customspoint__customsoffice',
+        'customsofficer',
+        'from_country',
+        'to_country',
+    ).prefetch_related(
+        'administration_codexes',
+        'assigned_tasks',
+        Prefetch(
+            'stored_goods',
+            queryset=StoredGood.objects.select_related('product', 'unitofmeasurement', 'reasonforruleviolation')
+        ),
+    )
+
+
+# One output row of the report export: a report and one of its stored goods
+ReportRow = namedtuple('ReportRow', ['number', 'report', 'good', 'position'])
+
+
+def violation_value(name):
+    """Value of a violation field, empty for reports without a violation."""
+    return lambda row: getattr(row.report.violation, name, None) or ''
+
+
+def violation_date(name):
+    return lambda row: format_date(getattr(row.report.violation, name, None))
+
+
+def violator_name(row):
+    violation = row.report.violation
+    if violation is None:
+        return ''
+    if violation.violation_type in ['individual', 'official']:
+        return ' '.join(filter(None, [violation.violator_name, violation.violator_surname, violation.father_name]))
+    if violation.violation_type == 'legal entity':
+        return violation.company_name or ''
+    return ''
+
+
+def violator_address(row):
+    violation = row.report.violation
+    if violation is None:
+        return ''
+    return violation.violator_address or violation.address or ''
+
+
+def officer_name(row):
+    officer = row.report.customsofficer
+    return f"{officer.name} {officer.surname}".strip() if officer else ''
+
+
+def assigned_letters(report):
+    return [letter for task in report.assigned_tasks.all() for letter in task.assigned_letters.all()]
+
+
+class ReportExporter(Exporter):
+    sheet_title = _('Reports')
+    filename = 'reports'
+
+    styles = {
+        'report_header': dict(
+            font=Font(bold=True, color='FFFFFF', name='Times New Roman', size=12),
+            fill=GradientFill(stop=[Color(rgb='0072B2'), Color(rgb='0094D8')], type='linear', degree=0),
+            border=THIN_BORDER,
+            alignment=Alignment(horizontal='center', vertical='center', wrap_text=True),
+        ),
+        'report_row_odd': dict(
+            font=Font(name='Times New Roman', size=12),
+            fill=PatternFill(start_color='FFFFFF', end_color='FFFFFF', fill_type='solid'),
+            border=THIN_BORDER,
+            alignment=Alignment(horizontal='center', vertical='center', wrap_text=True),
+        ),
+        'report_row_even': dict(
+            font=Font(name='Times New Roman', size=12),
+            fill=PatternFill(start_color='EAEAEA', end_color='EAEAEA', fill_type='solid'),
+            border=THIN_BORDER,
+            alignment=Alignment(horizontal='center', vertical='center', wrap_text=True),
+        ),
+    }
+    header_style = 'report_header'
+    # Alternating row colours per report
+    row_styles = ('report_row_even', 'report_row_odd')
+    header_height = 45
+    freeze_panes = 'A3'
+    auto_filter = True
+    cache = True
+
+    columns = [
+        # Show the index only on the first row of each report
+        Column(_('T/b'), lambda row: row.number if row.position == 0 else '', width=5),
+        Column(_('Ish Toplum Number'), 'report__ish_toplum_number', width=20),
+        Column(_('Protocol Number'), 'report__protocol_number', width=15),
+        Column(_('Report date'), lambda row: format_date(row.report.report_date), width=15),
+        Column(_('Customs Office'), 'report__customsoffice__name', width=20),
+        Column(_('Customs Point'), 'report__customspoint__name', width=20),
+        Column(_('Violation Type'), violation_value('violation_type'), width=20),
+        Column(_('Violation'), violator_name, width=20),
+        Column(_('Passport Number'), violation_value('passport_number'), width=20),
+        Column(_('Passport Issue Date'), violation_date('passport_issue_date'), width=20),
+        Column(_('Date of Birth'), violation_date('date_of_birth'), width=20),
+        Column(_('Place of Birth'), violation_value('place_of_birth'), width=20),
+        Column(_('Address'), violator_address, width=20),
+        Column(_('Phone'), violation_value('phone'), width=20),
+        Column(_('Nationality'), 'report__violation__nationality__name', width=20),
+
+        # Stored good columns, empty for reports without stored goods
+        Column(_('Product Counter'), lambda row: row.position + 1, width=20),
+        Column(_('Product Name'), lambda row: row.good.product.name if row.good else '', width=20),
+        Column(_('Amount'), lambda row: row.good.amount if row.good else '', width=20),
+        Column(_('Unit of Measurement'), lambda row: getattr(row.good and row.good.unitofmeasurement, 'name', ''), width=20),
+        Column(_('Unit of Measurement'), lambda row: getattr(row.good and row.good.reasonforruleviolation, 'name', ''), width=20),
+        Column(_('Reason for Rule Violation'), lambda row: row.good.note if row.good else '', width=20),  # Yuze cykarylan yeri
+
+        Column(_('Entry/Exit/Transit'), lambda row: gettext(row.report.entry_exit_transit), width=20),
+        Column(_('From Country'), lambda row: getattr(row.report.from_country, 'name', ''), width=20),
+        Column(_('To Country'), lambda row: getattr(row.report.to_country, 'name', ''), width=20),
+        Column(_('Vehicle Brand'), lambda row: getattr(row.report.vehicle_brand, 'name', ''), width=20),
+        Column(_('Car Number'), 'report__carnumber', width=20),
+        Column(_('Transport Company Name'), lambda row: getattr(row.report.transport_company, 'name', ''), width=20),
+        Column(_('Basis for Discovery'), lambda row: getattr(row.report.basisfordiscovery, 'name', ''), width=20),
+        Column(_('Method of Discovery'), lambda row: getattr(row.report.methodofdiscovery, 'name', ''), width=20),
+        Column(_('Administration Codexes'), lambda row: ', '.join(codex.name for codex in row.report.administration_codexes.all()), width=20),
+
+        Column(_('Customs Officer'), officer_name, width=20),
+        Column(_('Position'), 'report__customsofficer__position__name', width=20),
+        Column(_('Military Name'), 'report__customsofficer__militaryname__name', width=20),
+        Column(_('Language of Work Conducted'), 'report__language_of_work_conducted', width=20),
+        Column(_('Witness Full Names'), lambda row: ', '.join(witness.fullname or ' ' for witness in row.report.witnesses.all()), width=20),
+        Column(_('Witness Address'), lambda row: ', '.join(witness.address or ' ' for witness in row.report.witnesses.all()), width=35),
+
+        # Assigned Task fields
+        Column(_('Assigned Task Manat'), lambda row: ', '.join(f"{task.salnan_jerime}" for task in row.report.assigned_tasks.all()), width=20),
+        Column(_('Assigned Task Workgroup'), lambda row: ', '.join(task.workgroup.name for task in row.report.assigned_tasks.all()), width=20),
+
+        # Assigned Letter fields
+        Column(_('Assigned Letter Number'), lambda row: ', '.join(letter.number for letter in assigned_letters(row.report)), width=20),
+        Column(_('Assigned Letter Date'), lambda row: ', '.join(format_date(letter.date) for letter in assigned_letters(row.report)), width=20),
+        Column(_('Letter for Action'), lambda row: ', '.join(letter.letterforaction.name for letter in assigned_letters(row.report)), width=20),
+
+        Column(_('Created At'), lambda row: naive_localtime(row.report.created_at), width=20),
+        Column(_('Updated At'), lambda row: naive_localtime(row.report.updated_at), width=20),
+    ]
+
+    def get_queryset(self, queryset):
+        return get_report_export_queryset(queryset)
+
+    def get_rows(self, queryset, progress=None):
+        for number, report in self.iter_objects(queryset, progress):
+            # Reports without stored goods still get one row with empty stored good columns
+            goods = report.stored_goods.all() or [None]
+            for position, good in enumerate(goods):
+                yield number, ReportRow(number, report, good, position)
+
+
+class ReportSummary(Exporter):
+    """
+    Summary sheet of the report export.
+
+    ``get_queryset`` returns a ``values_list()`` aggregate, so every summary
+    costs one GROUP BY query however many reports are selected.
+    """
+    header_style = ReportExporter.header_style
+    row_styles = ReportExporter.row_styles
+    freeze_panes = 'A2'
+
+
+class ReportsPerOfficeSummary(ReportSummary):
+    sheet_title = _('Reports per office')
+
+    columns = [
+        Column(_('Customs Office'), itemgetter(0), width=40),
+        Column(_('Month'), lambda row: row[1].strftime('%m.%Y') if row[1] else '', width=15),
+        Column(_('Reports'), itemgetter(2), width=15),
+    ]
+
+    def get_queryset(self, queryset):
+        return (
+            queryset.order_by()
+            .annotate(month=TruncMonth('report_date'))
+            .values_list('customsoffice__name', 'month')
+            .annotate(reports=Count('pk'))
+            .order_by('customsoffice__name', 'month')
+        )
+
+
+class FinesSummary(ReportSummary):
+    sheet_title = _('Fines')
+
+    columns = [
+        Column(_('Customs Office'), itemgetter(0), width=40),
+        Column(_('Assigned Tasks'), itemgetter(1), width=15),
+        Column(_('Salnan jerime'), itemgetter(2), width=20),
+        Column(_('Tölenen jerime (Manat)'), itemgetter(3), width=20),
+        Column(_('Unpaid'), itemgetter(4), width=20),
+    ]
+
+    def get_queryset(self, queryset):
+        return (
+            AssignedTask.objects.filter(report__in=queryset.order_by().values('pk'))
+            .values_list('report__customsoffice__name')
+            .annotate(
+                tasks=Count('pk'),
+                imposed=Sum('salnan_jerime', default=0),
+                paid=Sum('tolenen_manat', default=0),
+            )
+            .annotate(unpaid=F('imposed') - F('paid'))
+            .order_by('report__customsoffice__name')
+        )
+
+
+class SeizedGoodsSummary(ReportSummary):
+    sheet_title = _('Seized goods')
+
+    columns = [
+        Column(_('Product Name'), itemgetter(0), width=40),
+        Column(_('Unit of Measurement'), itemgetter(1), width=20),
+        Column(_('Amount'), itemgetter(2), width=20),
+        Column(_('Stored Goods'), itemgetter(3), width=15),
+        Column(_('Reports'), itemgetter(4), width=15),
+    ]
+
+    def get_queryset(self, queryset):
+        return (
+            StoredGood.objects.filter(report__in=queryset.order_by().values('pk'))
+            .values_list('product__name', 'unitofmeasurement__name')
+            .annotate(amount=Sum('amount'), goods=Count('pk'), reports=Count('report', distinct=True))
+            .order_by('product__name', 'unitofmeasurement__name')
+        )
+
+
+class ReportWithSummariesExporter(ReportExporter):
+    filename = 'reports_with_totals'
+    summaries = [ReportsPerOfficeSummary, FinesSummary, SeizedGoodsSummary]
+
+
+# One output row of the grouped export: a violator's group, one of their
+# reports and one of its stored goods
+GroupedReportRow = namedtuple('GroupedReportRow', ['group', 'report', 'good', 'first_task', 'first'])
+
+
+def group_value(key):
+    """Violator-level value, only written on the first row of the violator's group."""
+    return lambda row: row.group[key] if row.first else ''
+
+
+class GroupedReportExporter(Exporter):
+    sheet_title = 'Reports Export'
+    filename = 'report_export'
+
+    styles = {
+        'grouped_header': dict(
+            font=Font(bold=True),
+            alignment=Alignment(horizontal='center', vertical='center'),
+            border=THIN_BORDER,
+        ),
+        'grouped_wrap': dict(alignment=Alignment(wrap_text=True)),
+    }
+    header_style = 'grouped_header'
+    cache = True
+
+    columns = [
+        Column("No.", group_value('number')),
+        Column("Offender Side", group_value('violation_type')),
+        Column("Full Name of Offender", group_value('fullname'), width=30, style='grouped_wrap'),
+        Column("Date of Birth", group_value('dob')),
+        Column("Passport Number", group_value('passport')),
+        Column("Citizenship", group_value('nationality')),
+        Column("Address", group_value('address'), width=35, style='grouped_wrap'),
+        Column("Number of Offenders", group_value('count')),
+        Column("Customs Office", lambda row: getattr(row.report.customspoint.customsoffice, 'name', '') if row.report.customspoint else ''),
+        Column("Customs Checkpoint", lambda row: row.report.customspoint.name if row.report.customspoint else ''),
+        Column("Explanatory Note Number", 'report__protocol_number'),
+        Column("Date of Preparation", lambda row: format_date(row.report.report_date)),
+        Column("Goods", lambda row: row.good.product.name if row.good and row.good.product else ''),
+        Column("Quantity", lambda row: f"{row.good.amount} {getattr(row.good.unitofmeasurement, 'name', '')}" if row.good else ''),
+        Column("Place of Discovery", lambda row: str(row.good.reasonforruleviolation) if row.good and row.good.reasonforruleviolation else ''),
+        Column("Entry / Exit / Transit", 'report__entry_exit_transit'),
+        Column("Country of Origin", lambda row: str(row.report.from_country) if row.report.from_country else ''),
+        Column("Destination Country", lambda row: str(row.report.to_country) if row.report.to_country else ''),
+        Column("Vehicle Registration Number", lambda row: str(row.report.carnumber) if row.report.carnumber else ''),
+        Column("Articles of the Customs Code", lambda row: ", ".join(str(c) for c in row.report.administration_codexes.all())),
+        Column("Imposed Fine (manat)", lambda row: row.first_task.salnan_jerime if row.first_task else ''),
+        Column("Paid Fine (manat)", lambda row: row.first_task.tolenen_manat if row.first_task else ''),
+        Column("Customs Officer", lambda row: f"{row.report.customsofficer.surname} {row.report.customsofficer.name} {row.report.customsofficer.midname}".strip() if row.report.customsofficer else ''),
+    ]
+
+    def get_queryset(self, queryset):
+        return get_grouped_report_queryset(queryset)
+
+    def get_groups(self, queryset, progress=None):
+        """
+        Read every report in one ordered pass and group them by violation.
+
+        Groups keep the order in which their first report appears in the
+        queryset and are then sorted by the number of offences.
+        """
+        grouped_reports = {}
+        for number, report in self.iter_objects(queryset, progress):
+            grouped_reports.setdefault(report.violation_id, []).append(report)
+
+        groups = []
+        for reports in grouped_reports.values():
+            violation = reports[0].violation
+            violation_type = violation.violation_type or ''
+
+            if violation_type.lower() == "legal entity":
+                fullname = f"{violation.company_name or ''}\nÝolbaşçysy: {violation.company_boss_fullname or ''}"
+                address = violation.address
+            else:
+                fullname = f"{violation.violator_surname or ''} {violation.violator_name or ''} {violation.father_name or ''}".strip()
+                address = violation.violator_address
+
+            groups.append({
+                "violation_type": violation_type,
+                "fullname": fullname,
+                "dob": format_date(violation.date_of_birth),
+                "passport": violation.passport_number or '',
+                "nationality": getattr(violation.nationality, 'name', ''),
+                "address": address,
+                "count": len(reports),
+                "reports": reports
+            })
+
+        groups.sort(key=itemgetter('count'), reverse=True)
+        for number, group in enumerate(groups, start=1):
+            group['number'] = number
+        return groups
+
+    def get_rows(self, queryset, progress=None):
+        for group in self.get_groups(queryset, progress):
+            first = True
+            for report in group['reports']:
+                # The first assigned task in the default (-created_at) ordering
+                assigned_tasks = report.assigned_tasks.all()
+                first_task = assigned_tasks[0] if assigned_tasks else None
+                for good in report.stored_goods.all() or [None]:
+                    yield group['number'], GroupedReportRow(group, report, good, first_task, first)
+                    first = False
@@ -0,0 +1,46 @@
+"""
+Cached facet counts of the report change list filters.
+
+Every filter's counts are an aggregate over the reports matching the other
+active filters and the search. They are cached in the shared cache under the
+SQL of that queryset and the reports' version token (customs_registry/choices.py),
+which the report signals replace whenever a report is saved or deleted or its
+codexes change, so every worker process sees new counts on its next page load.
+Going back to a filter combination seen since the last change costs no
+query; changes made without signals show up after FACET_CACHE_TIMEOUT.
+"""
+from django.contrib.admin.filters import FacetsMixin
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+
+from customs_registry.choices import get_model_version
+from .export_cache import get_cache_key
+
+FACET_CACHE_TIMEOUT = 10 * 60
+
+
+def get_cached_facet_counts(changelist, spec):
+    """The facet counts of the filter ``spec``, as FacetsMixin.get_facet_queryset returns them."""
+    parameters = spec.expected_parameters()
+    filtered_qs = changelist.get_queryset(spec.request, exclude_parameters=parameters).order_by()
+    key = get_cache_key(
+        f'facets:{type(spec).__qualname__}:{",".join(parameters)}',
+        filtered_qs,
+        data_version=str(get_model_version(changelist.model)),
+    )
+    counts = cache.get(key)
+    if counts is None:
+        counts = filtered_qs.aggregate(**spec.get_facet_counts(changelist.pk_attname, filtered_qs))
+        cache.set(key, counts, FACET_CACHE_TIMEOUT)
+    return counts
+
+
+class CachedFacetsChangeList(ChangeList):
+    """Change list whose filters take their facet counts from the cache."""
+
+    def get_filters(self, request):
+        filter_specs, *rest = super().get_filters(request)
+        for spec in filter_specs:
+            if isinstance(spec, FacetsMixin):
+                spec.get_facet_queryset = lambda changelist, spec=spec: get_cached_facet_counts(changelist, spec)
+        return filter_specs, *rest
@@ -0,0 +1,181 @@
+"""
+Admin exports built by a background worker instead of inside the request.
+
+An export action stores an ExportJob holding the pickled ``Query`` of the
+selected queryset, so the worker (the ``run_export_jobs`` command) rebuilds
+exactly the same filters, search and selection. Workers claim the oldest
+pending job with ``SELECT ... FOR UPDATE SKIP LOCKED``, so several of them
+can poll the table without taking the same job, and report the rows written
+so far on the job while they build the file. A job still running
+``EXPORT_JOB_TIMEOUT`` seconds after it was claimed lost its worker and is
+marked as failed by the next claim.
+"""
+import pickle
+import tempfile
+import traceback
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone, translation
+from django.utils.html import format_html
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+
+from .instrumentation import instrument
+from .models import ExportJob
+
+
+# Everything the worker needs to know to build each export type.
+# Writers are referenced by dotted path so that the admin modules that enqueue
+# jobs and the modules that build the files don't import each other.
+EXPORT_TYPES = {
+    'reports': {
+        'model': 'report.Report',
+        'writer': 'report.utils.write_report_workbook',
+        'filename': 'reports',
+    },
+    'reports_with_summaries': {
+        'model': 'report.Report',
+        'writer': 'report.utils.write_report_workbook_with_summaries',
+        'filename': 'reports_with_totals',
+    },
+    'reports_csv': {
+        'model': 'report.Report',
+        'writer': 'report.utils.write_report_csv',
+        'filename': 'reports',
+        'extension': 'csv',
+    },
+    'reports_parquet': {
+        'model': 'report.Report',
+        'writer': 'report.utils.write_report_parquet',
+        'filename': 'reports',
+        'extension': 'parquet',
+    },
+    'reports_by_office': {
+        'model': 'report.Report',
+        'writer': 'report.sharding.write_office_workbook_in_parallel',
+        'filename': 'reports_by_office',
+    },
+    'grouped_reports': {
+        'model': 'report.Report',
+        'writer': 'report.utils.write_grouped_workbook',
+        'filename': 'report_export',
+    },
+    'customs_offices': {
+        'model': 'customs_registry.CustomsOffice',
+        'writer': 'customs_registry.admin.write_customs_offices_workbook',
+        'filename': 'customs_offices',
+    },
+    'customs_points': {
+        'model': 'customs_registry.CustomsPoint',
+        'writer': 'customs_registry.admin.write_customs_points_workbook',
+        'filename': 'customs_points',
+    },
+}
+
+
+def enqueue_export(user, export_type, queryset):
+    """Create a pending job for ``queryset``; the worker picks it up later."""
+    return ExportJob.objects.create(
+        user=user,
+        export_type=export_type,
+        query=pickle.dumps(queryset.query),
+        language=translation.get_language() or 'tk',
+    )
+
+
+def get_job_queryset(job):
+    """Rebuild the queryset the job was enqueued with."""
+    model = apps.get_model(EXPORT_TYPES[job.export_type]['model'])
+    queryset = model._default_manager.all()
+    queryset.query = pickle.loads(bytes(job.query))
+    return queryset
+
+
+def claim_next_job():
+    """
+    Mark the oldest pending job as running and return it.
+
+    Rows are locked with SKIP LOCKED so several workers can poll the same table.
+    Jobs running for longer than ``EXPORT_JOB_TIMEOUT`` lost their worker and
+    are marked as failed, so they don't show as running forever.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ExportJob.objects.filter(
+            status=ExportJob.STATUS_RUNNING,
+            started_at__lt=now - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT),
+        ).update(
+            status=ExportJob.STATUS_FAILED,
+            error=_('The export worker stopped before the export was finished.'),
+            finished_at=now,
+        )
+        job = (
+            ExportJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=ExportJob.STATUS_PENDING)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = ExportJob.STATUS_RUNNING
+        job.started_at = now
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def run_export_job(job):
+    """Build the file for a claimed job and store it on the job."""
+    export = EXPORT_TYPES[job.export_type]
+    writer = import_string(export['writer'])
+
+    def update_progress(processed_rows):
+        ExportJob.objects.filter(pk=job.pk).update(processed_rows=processed_rows)
+
+    try:
+        queryset = get_job_queryset(job)
+        job.total_rows = queryset.count()
+        job.save(update_fields=['total_rows'])
+
+        with translation.override(job.language), tempfile.TemporaryFile() as output:
+            with instrument(job.export_type, job.user):
+                writer(queryset, output, progress=update_progress)
+            output.seek(0)
+            extension = export.get('extension', 'xlsx')
+            filename = f"{export['filename']}_{timezone.localtime().strftime('%Y%m%d_%H%M%S')}.{extension}"
+            job.file.save(filename, File(output), save=False)
+
+        job.status = ExportJob.STATUS_DONE
+        job.processed_rows = job.total_rows
+    except Exception:
+        job.status = ExportJob.STATUS_FAILED
+        job.error = traceback.format_exc()
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'processed_rows', 'file', 'error', 'finished_at'])
+    return job
+
+
+def background_export_action(export_type, description):
+    """Build an admin action that queues ``export_type`` instead of building it in the request."""
+
+    def action(modeladmin, request, queryset):
+        job = enqueue_export(request.user, export_type, queryset)
+        url = reverse('admin:report_exportjob_changelist')
+        modeladmin.message_user(
+            request,
+            format_html(
+                _('Export #{} has been queued. Follow its progress and download it from <a href="{}">Export jobs</a>.'),
+                job.pk,
+                url,
+            )
+        )
+
+    action.__name__ = f'{export_type}_in_background'
+    action.short_description = description
+    return action
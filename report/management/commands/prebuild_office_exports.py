@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from customs_registry.models import CustomsOffice
+from report.prebuilt import build_prebuilt_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Build every customs office's reports workbook for this year ahead of time. "
+        "Meant to run nightly, e.g. from cron; unchanged offices are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--year',
+            type=int,
+            default=None,
+            help='Year to build (default: the current year).',
+        )
+        parser.add_argument(
+            '--language',
+            action='append',
+            dest='languages',
+            help='Language of the workbook; repeat for several (default: every language in LANGUAGES).',
+        )
+        parser.add_argument(
+            '--office',
+            action='append',
+            type=int,
+            dest='offices',
+            help='Id of a customs office to build; repeat for several (default: all offices).',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rebuild even the workbooks whose data has not changed.',
+        )
+
+    def handle(self, *args, **options):
+        year = options['year'] or timezone.localdate().year
+        languages = options['languages'] or [code for code, name in settings.LANGUAGES]
+        offices = CustomsOffice.objects.order_by('name')
+        if options['offices']:
+            offices = offices.filter(pk__in=options['offices'])
+
+        for office in offices:
+            for language in languages:
+                prebuilt, built = build_prebuilt_export(office, year, language, force=options['force'])
+                if built:
+                    self.stdout.write(self.style.SUCCESS(f'Built {prebuilt}: {prebuilt.total_rows} reports'))
+                else:
+                    self.stdout.write(f'Unchanged {prebuilt}')
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from report.jobs import claim_next_job, run_export_job
+from report.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = 'Build queued admin exports in the background, outside the web workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait before polling again when there is nothing to do.',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the jobs that are currently queued and exit.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write(f'Running {job}')
+            job = run_export_job(job)
+            if job.status == ExportJob.STATUS_DONE:
+                self.stdout.write(self.style.SUCCESS(f'Finished {job}: {job.file.name}'))
+            else:
+                self.stderr.write(f'Failed {job}:\n{job.error}')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from report.models import Report
+from report.search import SEARCH_DOCUMENT_CHUNK_SIZE, is_supported, update_search_documents
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the reports' full-text search documents. Run once after upgrading, "
+        "and after renaming shared lookups such as countries, products or customs offices."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Only build the reports that have no search document yet.',
+        )
+
+    def handle(self, *args, **options):
+        if not is_supported():
+            raise CommandError('Full-text search documents need a PostgreSQL database.')
+
+        reports = Report.objects.order_by('pk')
+        if options['missing']:
+            reports = reports.filter(search_document__isnull=True)
+        report_ids = list(reports.values_list('pk', flat=True))
+
+        for start in range(0, len(report_ids), SEARCH_DOCUMENT_CHUNK_SIZE):
+            update_search_documents(report_ids[start:start + SEARCH_DOCUMENT_CHUNK_SIZE])
+            self.stdout.write(f'{min(start + SEARCH_DOCUMENT_CHUNK_SIZE, len(report_ids))}/{len(report_ids)}')
+        self.stdout.write(self.style.SUCCESS(f'Updated {len(report_ids)} search documents'))
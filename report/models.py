@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
@@ -157,7 +158,7 @@ class Report(models.Model):
         null=True
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
-    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated At'))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated At'), db_index=True)
 
     user = models.ForeignKey(
         User,
@@ -167,10 +168,16 @@ class Report(models.Model):
         verbose_name=_('Created by User'),
         related_name='reports',
     )
+    # Full-text search document, see report/search.py
+    search_document = SearchVectorField(null=True, editable=False)
+
     class Meta:
         verbose_name = _('Report')
         verbose_name_plural = _('Reports')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='report_created_desc'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['ud_belgi'], 
@@ -365,3 +372,171 @@ class AssignedLetter(models.Model):
 
     def __str__(self):
         return f"Letter {self.number} for {self.assignedtask} on {self.date}"
+
+
+class ExportJob(models.Model):
+    """An export that is built by the export worker instead of inside the request."""
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_DONE, _('Done')),
+        (STATUS_FAILED, _('Failed')),
+    ]
+
+    EXPORT_TYPE_CHOICES = [
+        ('reports', _('Reports')),
+        ('reports_csv', _('Reports (CSV)')),
+        ('reports_parquet', _('Reports (Parquet)')),
+        ('reports_by_office', _('Reports by customs office')),
+        ('reports_with_summaries', _('Reports with summary sheets')),
+        ('grouped_reports', _('1+ saklananlar')),
+        ('customs_offices', _('Customs Offices')),
+        ('customs_points', _('Customs Points')),
+    ]
+
+    export_type = models.CharField(
+        max_length=50,
+        choices=EXPORT_TYPE_CHOICES,
+        verbose_name=_('Export type')
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+        verbose_name=_('Status'),
+        db_index=True
+    )
+    # Pickled django.db.models.sql.Query of the selected queryset
+    query = models.BinaryField(verbose_name=_('Query'))
+    language = models.CharField(max_length=10, verbose_name=_('Language'))
+    total_rows = models.PositiveIntegerField(default=0, verbose_name=_('Total rows'))
+    processed_rows = models.PositiveIntegerField(default=0, verbose_name=_('Processed rows'))
+    file = models.FileField(
+        upload_to='exports/%Y/%m/',
+        blank=True,
+        null=True,
+        verbose_name=_('File')
+    )
+    error = models.TextField(blank=True, default='', verbose_name=_('Error'))
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='export_jobs',
+        verbose_name=_('User')
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name=_('Started At'))
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name=_('Finished At'))
+
+    class Meta:
+        verbose_name = _('Export job')
+        verbose_name_plural = _('Export jobs')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_export_type_display()} #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def progress(self):
+        """Progress of the job in percent."""
+        if self.status == self.STATUS_DONE:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(100, int(self.processed_rows * 100 / self.total_rows))
+
+
+class ExportWatermark(models.Model):
+    """How far a user's incremental exports of one type and selection have got."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='export_watermarks',
+        verbose_name=_('User')
+    )
+    export_type = models.CharField(max_length=50, verbose_name=_('Export type'))
+    # Fingerprint of the query of the selected reports (filters, search, ids)
+    selection = models.CharField(max_length=64, default='', verbose_name=_('Selection'))
+    # Start time of the last successful export; the next one picks up
+    # everything changed after it
+    exported_until = models.DateTimeField(verbose_name=_('Exported until'))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated At'))
+
+    class Meta:
+        verbose_name = _('Export watermark')
+        verbose_name_plural = _('Export watermarks')
+        unique_together = ('user', 'export_type', 'selection')
+        ordering = ['user', 'export_type']
+
+    def __str__(self):
+        return f"{self.user} - {self.export_type}"
+
+
+class PrebuiltExport(models.Model):
+    """A customs office's reports workbook for one year, built overnight by ``prebuild_office_exports``."""
+
+    customsoffice = models.ForeignKey(
+        CustomsOffice,
+        on_delete=models.CASCADE,
+        related_name='prebuilt_exports',
+        verbose_name=_('Customs Office')
+    )
+    year = models.PositiveIntegerField(verbose_name=_('Year'))
+    language = models.CharField(max_length=10, verbose_name=_('Language'))
+    file = models.FileField(upload_to='exports/prebuilt/%Y/', verbose_name=_('File'))
+    # Data version of the office's reports when the file was built
+    data_version = models.TextField(verbose_name=_('Data version'))
+    total_rows = models.PositiveIntegerField(default=0, verbose_name=_('Total rows'))
+    built_at = models.DateTimeField(verbose_name=_('Built at'))
+
+    class Meta:
+        verbose_name = _('Prebuilt export')
+        verbose_name_plural = _('Prebuilt exports')
+        unique_together = ('customsoffice', 'year', 'language')
+        ordering = ['-year', 'customsoffice__name', 'language']
+
+    def __str__(self):
+        return f"{self.customsoffice} {self.year} ({self.language})"
+
+    def get_queryset(self):
+        """The reports the workbook holds."""
+        return Report.objects.filter(customsoffice=self.customsoffice_id, report_date__year=self.year)
+
+
+class ExportRun(models.Model):
+    """Measurements of one export, recorded when EXPORT_INSTRUMENTATION is on."""
+
+    name = models.CharField(max_length=200, verbose_name=_('Export'), db_index=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='export_runs',
+        verbose_name=_('User')
+    )
+    rows = models.PositiveIntegerField(default=0, verbose_name=_('Rows'))
+    query_count = models.PositiveIntegerField(default=0, verbose_name=_('SQL queries'))
+    query_time = models.FloatField(default=0, verbose_name=_('SQL time (s)'))
+    peak_memory = models.BigIntegerField(default=0, verbose_name=_('Peak memory (bytes)'))
+    row_building_time = models.FloatField(default=0, verbose_name=_('Row building (s)'))
+    styling_time = models.FloatField(default=0, verbose_name=_('Styling (s)'))
+    writing_time = models.FloatField(default=0, verbose_name=_('Writing (s)'))
+    saving_time = models.FloatField(default=0, verbose_name=_('Saving (s)'))
+    total_time = models.FloatField(default=0, verbose_name=_('Total (s)'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
+
+    class Meta:
+        verbose_name = _('Export run')
+        verbose_name_plural = _('Export runs')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}"
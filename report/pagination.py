@@ -0,0 +1,304 @@
+"""
+Change list pagination for the large tables.
+
+KeysetPaginationMixin makes a ModelAdmin list its rows by ``keyset_fields``
+(descending, empty values last) and page through them with ``?after=`` and
+``?before=`` cursors holding the last or first row's values. Every page is
+an index range scan, however deep it is, instead of an ``OFFSET`` that reads
+and throws away all the rows before it. Sorting by a column falls back to
+the usual numbered pages.
+
+EstimatedCountPaginator gives the number of results from the PostgreSQL
+planner's statistics instead of a ``COUNT(*)`` when there are many of them.
+
+With ``virtual_show_all``, "Show all" renders no rows on the page itself: a
+virtual scrolling table (static/js/virtual_change_list.js) loads them in
+pages from the admin's ``rows/`` JSON view and keeps only the visible ones
+in the document. Actions on "all" of them use the admin's ``select_across``
+and so run on the filtered queryset, not on a list of ids.
+
+PaginatedInlineMixin shows the rows of an inline one page at a time, so a
+change form with many related rows renders, posts and validates only one
+page of them.
+"""
+import json
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.templatetags.admin_list import items_for_result
+from django.contrib.admin.views.main import ALL_VAR, IS_FACETS_VAR, ChangeList
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet
+from django.db import connections
+from django.db.models import F, Q
+from django.http import JsonResponse
+from django.urls import path
+from django.utils.functional import cached_property
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+CURSOR_VARS = (AFTER_VAR, BEFORE_VAR)
+# Position of a rows page of the "Show all" table when it is sorted by a column
+OFFSET_VAR = 'offset'
+
+
+def estimate_count(queryset):
+    """Row count of ``queryset`` estimated by the PostgreSQL planner, or None on other databases."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if not queryset.query.where:
+        # Whole table: the statistics kept by VACUUM/ANALYZE, no planning needed
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 for a table that was never analyzed
+        return int(row[0]) if row and row[0] >= 0 else None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator counting exactly only when the planner expects few rows."""
+
+    # Below this many estimated rows the exact count is cheap enough
+    estimate_threshold = 10000
+
+    count_is_estimated = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < self.estimate_threshold:
+            return super().count
+        self.count_is_estimated = True
+        return estimate
+
+
+class KeysetChangeList(ChangeList):
+    """Change list paging by ``model_admin.keyset_fields`` cursors while it is sorted by them."""
+
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(request, *args, **kwargs)
+        # Filter, sort and search links start again from the first page
+        for name in CURSOR_VARS:
+            self.params.pop(name, None)
+        self.remove_facet_link = self.get_query_string(remove=[IS_FACETS_VAR])
+        self.add_facet_link = self.get_query_string({IS_FACETS_VAR: True})
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for name in CURSOR_VARS:
+            lookup_params.pop(name, None)
+        return lookup_params
+
+    @property
+    def keyset_fields(self):
+        return [self.lookup_opts.get_field(name) for name in self.model_admin.keyset_fields]
+
+    def parse_cursor(self, value):
+        values = value.split(',')
+        fields = self.keyset_fields
+        if len(values) != len(fields):
+            raise IncorrectLookupParameters
+        try:
+            return [field.to_python(value) if value else None for field, value in zip(fields, values)]
+        except ValidationError:
+            raise IncorrectLookupParameters
+
+    def get_cursor(self, obj):
+        values = [getattr(obj, field.attname) for field in self.keyset_fields]
+        return ','.join('' if value is None else str(value) for value in values)
+
+    def get_keyset_condition(self, values, after):
+        """
+        Rows after (or before) the row holding ``values`` in descending,
+        empty-values-last order: equal on the leading fields and beyond on the next one.
+
+        The OR of those branches is ANDed with a bound on the first field, which
+        the database can use as the start of an index range scan.
+        """
+        fields = self.keyset_fields
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, value in zip(fields, values):
+            if after and value is not None:
+                beyond = Q(**{f'{field.name}__lt': value})
+                if field.null:
+                    beyond |= Q(**{f'{field.name}__isnull': True})
+                condition |= equal & beyond
+            elif not after:
+                if value is None:
+                    condition |= equal & Q(**{f'{field.name}__isnull': False})
+                else:
+                    condition |= equal & Q(**{f'{field.name}__gt': value})
+            equal &= Q(**{f'{field.name}__isnull': True}) if value is None else Q(**{field.name: value})
+
+        # Empty values come after every other one, so a nullable first field has no bound going forward
+        field, value = fields[0], values[0]
+        if value is not None and not (after and field.null):
+            condition &= Q(**{f'{field.name}__{"lte" if after else "gte"}': value})
+        return condition
+
+    def get_results(self, request):
+        super().get_results(request)
+        keyset_ordering = self.model_admin.get_keyset_ordering()
+        # Anything ordered after the keyset (which ends with the primary key) changes nothing
+        self.keyset_ordered = list(self.queryset.query.order_by[:len(keyset_ordering)]) == keyset_ordering
+        self.virtual_show_all = self.show_all and self.can_show_all and self.model_admin.virtual_show_all
+        if self.virtual_show_all:
+            # The rows are loaded by the virtual scrolling table
+            self.result_list = self.queryset.none()
+        self.keyset_pagination = self.keyset_ordered and not (self.show_all and self.can_show_all) and self.multi_page
+        if not self.keyset_pagination:
+            return
+
+        per_page = self.list_per_page
+        after, before = request.GET.get(AFTER_VAR), request.GET.get(BEFORE_VAR)
+        if before:
+            rows = list(
+                self.queryset.filter(self.get_keyset_condition(self.parse_cursor(before), after=False))
+                .order_by(*[ordering.reverse_ordering() for ordering in self.model_admin.get_keyset_ordering()])
+                [:per_page + 1]
+            )
+            has_previous, has_next = len(rows) > per_page, True
+            rows = rows[:per_page][::-1]
+        else:
+            queryset = self.queryset
+            if after:
+                queryset = queryset.filter(self.get_keyset_condition(self.parse_cursor(after), after=True))
+            rows = list(queryset[:per_page + 1])
+            has_previous, has_next = bool(after), len(rows) > per_page
+            rows = rows[:per_page]
+
+        self.result_list = rows
+        self.first_page_url = self.get_query_string(remove=CURSOR_VARS) if has_previous else None
+        self.previous_page_url = (
+            self.get_query_string({BEFORE_VAR: self.get_cursor(rows[0])}, remove=CURSOR_VARS)
+            if has_previous and rows else None
+        )
+        self.next_page_url = (
+            self.get_query_string({AFTER_VAR: self.get_cursor(rows[-1])}, remove=CURSOR_VARS)
+            if has_next and rows else None
+        )
+        self.show_all_url = self.get_query_string({ALL_VAR: ''}, remove=CURSOR_VARS) if self.can_show_all else None
+
+
+class KeysetPaginationMixin:
+    """
+    ModelAdmin mixin for the large tables: keyset pages on ``keyset_fields``
+    and estimated result counts, without the second count of the unfiltered table.
+    """
+    keyset_fields = ('id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/keyset_change_list.html'
+    # Render "Show all" as a virtual scrolling table fed by changelist_rows_view
+    virtual_show_all = False
+    virtual_page_size = 100
+
+    def get_keyset_ordering(self):
+        # Plain DESC on NOT NULL columns, so a DESC index serves it (PostgreSQL puts nulls first by default)
+        return [
+            F(name).desc(nulls_last=True) if self.opts.get_field(name).null else F(name).desc()
+            for name in self.keyset_fields
+        ]
+
+    def get_ordering(self, request):
+        return super().get_ordering(request) or self.get_keyset_ordering()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        urls = [
+            path('rows/', self.admin_site.admin_view(self.changelist_rows_view), name='%s_%s_changelist_rows' % info),
+        ]
+        return urls + super().get_urls()
+
+    def changelist_rows_view(self, request):
+        """
+        A page of the "Show all" rows as JSON, with the same filters, search and
+        sorting as the change list, and the URL of the next page.
+        """
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        params = request.GET.copy()
+        after = params.pop(AFTER_VAR, [''])[-1]
+        offset = params.pop(OFFSET_VAR, ['0'])[-1]
+        params[ALL_VAR] = ''
+        request.GET = params
+        try:
+            cl = self.get_changelist_instance(request)
+            offset = int(offset)
+            if cl.keyset_ordered:
+                queryset = cl.queryset
+                if after:
+                    queryset = queryset.filter(cl.get_keyset_condition(cl.parse_cursor(after), after=True))
+                rows = list(queryset[:self.virtual_page_size + 1])
+            else:
+                # Sorted by a column: no cursor to continue from
+                rows = list(cl.queryset[offset:offset + self.virtual_page_size + 1])
+        except (IncorrectLookupParameters, ValueError):
+            return JsonResponse({'error': 'Invalid parameters.'}, status=400)
+
+        next_url = None
+        if len(rows) > self.virtual_page_size:
+            rows = rows[:self.virtual_page_size]
+            if cl.keyset_ordered:
+                next_params = {AFTER_VAR: cl.get_cursor(rows[-1])}
+            else:
+                next_params = {OFFSET_VAR: offset + self.virtual_page_size}
+            next_url = request.path + cl.get_query_string(next_params, remove=[ALL_VAR])
+        return JsonResponse({
+            'rows': [{'pk': str(row.pk), 'html': ''.join(items_for_result(cl, row, None))} for row in rows],
+            'next': next_url,
+        })
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """Inline formset editing one page of the related rows, the ``page_param`` page of the request."""
+    per_page = 20
+    page_param = 'page'
+    page_number = None
+    # The change form's query string, kept in the page links
+    query = None
+
+    @cached_property
+    def page(self):
+        return Paginator(super().get_queryset(), self.per_page).get_page(self.page_number)
+
+    def get_queryset(self):
+        return self.page.object_list
+
+    @property
+    def page_links(self):
+        links = []
+        for number in self.page.paginator.get_elided_page_range(self.page.number):
+            query = self.query.copy()
+            query[self.page_param] = number
+            links.append({'number': number, 'url': f'?{query.urlencode()}', 'current': number == self.page.number})
+        return links
+
+
+class PaginatedInlineMixin:
+    """
+    InlineModelAdmin mixin showing ``per_page`` related rows at a time, with
+    links to the other pages. Only the rows of the page are posted, and of
+    those only the changed ones are saved; unsaved edits are lost when
+    following a page link.
+    """
+    formset = PaginatedInlineFormSet
+    per_page = 20
+    template = 'admin/edit_inline/paginated_tabular.html'
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        page_param = f'{formset.get_default_prefix()}-page'
+        return type(formset.__name__, (formset,), {
+            'per_page': self.per_page,
+            'page_param': page_param,
+            'page_number': request.GET.get(page_param),
+            'query': request.GET.copy(),
+        })
@@ -0,0 +1,37 @@
+"""
+Which reports a user may edit: their own and those of the users listed in
+their UserProfile.related_users; superusers may edit every report.
+
+The user ids are resolved with one query per request and kept on the
+request, as the admin checks the permission many times while rendering and
+saving a change form.
+"""
+from .models import UserProfile
+
+
+def get_editable_user_ids(request):
+    """Ids of the users whose reports ``request.user`` may edit, or None for all of them."""
+    if not hasattr(request, '_editable_user_ids'):
+        user = request.user
+        if user.is_superuser:
+            user_ids = None
+        else:
+            related_user_ids = UserProfile.related_users.through.objects.filter(
+                userprofile__user=user,
+            ).values_list('user_id', flat=True)
+            user_ids = frozenset([user.pk, *related_user_ids])
+        request._editable_user_ids = user_ids
+    return request._editable_user_ids
+
+
+def can_edit_report(request, report):
+    user_ids = get_editable_user_ids(request)
+    return user_ids is None or report.user_id in user_ids
+
+
+def filter_editable_reports(request, queryset):
+    """Limit ``queryset`` to the reports ``request.user`` may edit, using the index on ``user``."""
+    user_ids = get_editable_user_ids(request)
+    if user_ids is None:
+        return queryset
+    return queryset.filter(user__in=user_ids)
@@ -0,0 +1,47 @@
+"""
+Per-office "this year" workbooks, built ahead of time and served while still current.
+"""
+import tempfile
+
+from django.core.files import File
+from django.utils import timezone, translation
+
+from .export_cache import get_report_data_version
+from .exporters import ReportExporter
+from .models import PrebuiltExport, Report
+
+
+def build_prebuilt_export(office, year, language, force=False):
+    """
+    Build the workbook of ``office``'s reports for ``year`` unless the stored one is still current.
+
+    Return the PrebuiltExport and whether it was (re)built.
+    """
+    queryset = Report.objects.filter(customsoffice=office, report_date__year=year)
+    data_version = get_report_data_version(queryset)
+    prebuilt = PrebuiltExport.objects.filter(customsoffice=office, year=year, language=language).first()
+    if prebuilt and prebuilt.data_version == data_version and not force:
+        return prebuilt, False
+
+    if prebuilt is None:
+        prebuilt = PrebuiltExport(customsoffice=office, year=year, language=language)
+    old_file = prebuilt.file.name if prebuilt.file else None
+
+    with translation.override(language), tempfile.TemporaryFile() as output:
+        ReportExporter().write(queryset, output)
+        output.seek(0)
+        prebuilt.file.save(f'reports_{office.pk}_{year}_{language}.xlsx', File(output), save=False)
+
+    prebuilt.data_version = data_version
+    prebuilt.total_rows = queryset.count()
+    prebuilt.built_at = timezone.now()
+    prebuilt.save()
+
+    if old_file and old_file != prebuilt.file.name:
+        prebuilt.file.storage.delete(old_file)
+    return prebuilt, True
+
+
+def is_current(prebuilt):
+    """Whether nothing in the office's reports for the year changed since the file was built."""
+    return prebuilt.data_version == get_report_data_version(prebuilt.get_queryset())
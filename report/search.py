@@ -0,0 +1,211 @@
+"""
+Full-text search of the reports.
+
+Each report keeps a ``search_document`` (a PostgreSQL tsvector) built from
+every field listed in REPORT_SEARCH_FIELDS, including those of its violation,
+customs officer, stored goods and codexes. Searching it is a single GIN index
+lookup on the report table instead of ~40 ``ILIKE '%term%'`` predicates over
+a dozen joins.
+
+The documents are rebuilt by the signals in ``customs_registry.signals`` when
+a report or one of its children changes, once per report and transaction,
+and in bulk by the ``update_search_documents`` command. On databases other
+than PostgreSQL the document is left empty and the admin falls back to its
+``search_fields``.
+"""
+import re
+from datetime import date
+
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Manager, TextField, Value
+from rest_framework import filters
+
+from .models import Report
+
+# Text search configuration: no stemming, the data is Turkmen and Russian
+SEARCH_CONFIG = 'simple'
+
+SEARCH_INDEX_NAME = 'report_report_search_document_gin'
+
+# Lookups the search document is built from; also the admin's and API's fallback search_fields
+REPORT_SEARCH_FIELDS = (
+    'ud_belgi',
+    'vehicle_brand__name',
+    'transport_company__name',
+    'protocol_number',
+    'ish_toplum_number',
+    'report_date',
+    'customsoffice__name',
+    'customspoint__name',
+    'violation__violation_type',
+    'violation__company_name',
+    'violation__phone',
+    'violation__violator_name',
+    'violation__violator_surname',
+    'violation__father_name',
+    'violation__date_of_birth',
+    'violation__passport_number',
+    'violation__nationality__name',
+    'violation__nationality__code',
+    'entry_exit_transit',
+    'from_country__name',
+    'from_country__code',
+    'to_country__name',
+    'to_country__code',
+    'customsofficer__name',
+    'customsofficer__surname',
+    'customsofficer__midname',
+    'customsofficer__position__name',
+    'customsofficer__militaryname__name',
+    'basisfordiscovery__name',
+    'methodofdiscovery__name',
+    'administration_codexes__name',
+    'language_of_work_conducted',
+    'carnumber',
+    'stored_goods__product__name',
+    'stored_goods__amount',
+    'stored_goods__unitofmeasurement__name',
+    'stored_goods__note',
+    'user__username',
+)
+
+SEARCH_DOCUMENT_CHUNK_SIZE = 500
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def is_supported(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == 'postgresql'
+
+
+def get_search_document_queryset():
+    """Reports with every relation REPORT_SEARCH_FIELDS reads loaded in a fixed number of queries."""
+    return Report.objects.select_related(
+        'vehicle_brand',
+        'transport_company',
+        'customsoffice',
+        'customspoint',
+        'violation__nationality',
+        'from_country',
+        'to_country',
+        'customsofficer__position',
+        'customsofficer__militaryname',
+        'basisfordiscovery',
+        'methodofdiscovery',
+        'user',
+    ).prefetch_related(
+        'administration_codexes',
+        'stored_goods__product',
+        'stored_goods__unitofmeasurement',
+    ).order_by('pk')
+
+
+def get_lookup_values(obj, lookup):
+    """Values found at ``lookup`` ('a__b__c') from ``obj``, following to-many relations."""
+    objects = [obj]
+    for name in lookup.split('__'):
+        values = []
+        for current in objects:
+            value = getattr(current, name, None)
+            if isinstance(value, Manager):
+                values.extend(value.all())
+            elif value is not None:
+                values.append(value)
+        objects = values
+    return objects
+
+
+def format_search_value(value):
+    if isinstance(value, date):
+        # Searchable as typed in the forms and as stored
+        return f'{value:%d.%m.%Y} {value.isoformat()}'
+    return str(value)
+
+
+def get_search_text(report):
+    """Text of every searchable field of ``report``."""
+    return ' '.join(
+        format_search_value(value)
+        for lookup in REPORT_SEARCH_FIELDS
+        for value in get_lookup_values(report, lookup)
+        if value != ''
+    )
+
+
+def update_search_documents(report_ids):
+    """
+    Rebuild the search document of the given reports, with one UPDATE per
+    SEARCH_DOCUMENT_CHUNK_SIZE reports; does nothing on other databases than PostgreSQL.
+    """
+    if not is_supported():
+        return
+    reports = list(get_search_document_queryset().filter(pk__in=report_ids))
+    for report in reports:
+        report.search_document = SearchVector(
+            Value(get_search_text(report), output_field=TextField()), config=SEARCH_CONFIG,
+        )
+    Report.objects.bulk_update(reports, ['search_document'], batch_size=SEARCH_DOCUMENT_CHUNK_SIZE)
+
+
+def schedule_search_document_update(report_ids, using=DEFAULT_DB_ALIAS):
+    """
+    Rebuild the search documents of ``report_ids`` when the current transaction
+    commits, in one pass with every other report scheduled in it; reports
+    deleted by then are skipped.
+    """
+    if not is_supported(using):
+        return
+    connection = connections[using]
+    if not hasattr(connection, '_pending_search_documents'):
+        connection._pending_search_documents = set()
+    connection._pending_search_documents.update(report_ids)
+    # Only the first callback to run finds ids left; ids of a rolled back
+    # transaction are rebuilt with the next commit, which is harmless
+    transaction.on_commit(lambda: flush_search_document_updates(using), using=using)
+
+
+def flush_search_document_updates(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    report_ids = getattr(connection, '_pending_search_documents', None)
+    if report_ids:
+        connection._pending_search_documents = set()
+        update_search_documents(report_ids)
+
+
+def get_search_query(search_term):
+    """
+    Match the words of ``search_term`` exactly (websearch syntax, so quotes and
+    ``-word`` work) or as prefixes, so partial protocol numbers and names match.
+    """
+    query = SearchQuery(search_term, search_type='websearch', config=SEARCH_CONFIG)
+    words = WORD_RE.findall(search_term)
+    if words:
+        prefixes = ' & '.join(f'{word}:*' for word in words)
+        query |= SearchQuery(prefixes, search_type='raw', config=SEARCH_CONFIG)
+    return query
+
+
+def search_reports(queryset, search_term):
+    return queryset.filter(search_document=get_search_query(search_term))
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Create the GIN index of the search documents; connected to post_migrate, PostgreSQL only."""
+    if not is_supported(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} '
+            f'ON {Report._meta.db_table} USING gin (search_document)'
+        )
+
+
+class ReportSearchFilter(filters.SearchFilter):
+    """``?search=`` on the search documents, or on the view's search_fields on other databases."""
+
+    def filter_queryset(self, request, queryset, view):
+        search_term = request.query_params.get(self.search_param, '').strip()
+        if search_term and is_supported():
+            return search_reports(queryset, search_term)
+        return super().filter_queryset(request, queryset, view)
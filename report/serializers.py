@@ -1,12 +1,33 @@
 from django.contrib.auth.models import User, Group, Permission
 from customs_registry.models import  LettersForAction, Workgroup, StoredGood, StoredGoodImage, UnitOfMeasurement, ProductCategory, Product, TransportCompanyName, VehicleBrand, Country, Violation, ReasonForRuleViolation, MethodOfDiscovery, CustomsOffice, CustomsPoint, CustomsOfficer, AdministrationCodex, BasisForDiscovery
 from rest_framework import serializers
+from customs_registry.thumbnails import THUMBNAIL_SIZES, get_thumbnail_url
 from .models import AssignedLetter, Report, AssignedTask
 
+
+class ImageThumbnailsField(serializers.Field):
+    """Read-only URLs of every thumbnail size of an image, to use for previews instead of the full image."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        urls = {size: get_thumbnail_url(value, size) for size in THUMBNAIL_SIZES}
+        if request is not None:
+            urls = {size: request.build_absolute_uri(url) for size, url in urls.items()}
+        return urls
+
+
 class StoredGoodImageSerializer(serializers.ModelSerializer):
+    thumbnails = ImageThumbnailsField(source='image')
+
     class Meta:
         model = StoredGoodImage
-        fields = ['id', 'image', 'description', 'uploaded_at']
+        fields = ['id', 'image', 'thumbnails', 'description', 'uploaded_at']
 
 class StoredGoodSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -161,9 +182,11 @@ class UnitOfMeasurementSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class StoredGoodImageSerializer(serializers.ModelSerializer):
+    thumbnails = ImageThumbnailsField(source='image')
+
     class Meta:
         model = StoredGoodImage
-        fields = ['id', 'stored_good', 'image', 'description', 'uploaded_at']
+        fields = ['id', 'stored_good', 'image', 'thumbnails', 'description', 'uploaded_at']
 
 #class StoredGoodSerializer(serializers.ModelSerializer):
     #images = StoredGoodImageSerializer(many=True, read_only=True)  # Nested images
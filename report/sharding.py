@@ -0,0 +1,188 @@
+"""
+Report exports split by customs office, rendered in parallel by the export worker.
+
+Every office is written to a workbook of its own, by a process of a pool in
+the background export worker (run_export_jobs) and one after the other in a
+web request, which must neither fork nor close its connections. The
+workbooks all come from the same exporter and therefore share one style
+table, so their finished worksheets are copied as they are into a single
+workbook that also holds a summary sheet.
+"""
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+from django.utils import translation
+from django.utils.translation import gettext_lazy as _
+
+from customs_registry.models import CustomsOffice
+from .exporters import ReportExporter, styled_cell
+
+
+# Characters Excel doesn't allow in sheet titles
+INVALID_TITLE_CHARACTERS = re.compile(r'[\\/*?:\[\]]')
+MAX_TITLE_LENGTH = 31
+
+SUMMARY_TITLE = _('Summary')
+
+
+def get_sheet_titles(offices):
+    """Valid sheet titles for ``offices``, unique even when office names collide once shortened."""
+    used = {str(SUMMARY_TITLE).lower()}
+    titles = {}
+    for office in offices:
+        name = INVALID_TITLE_CHARACTERS.sub(' ', office.name).strip()[:MAX_TITLE_LENGTH] or str(office.pk)
+        title = name
+        copy = 2
+        while title.lower() in used:
+            suffix = f' ({copy})'
+            title = name[:MAX_TITLE_LENGTH - len(suffix)] + suffix
+            copy += 1
+        used.add(title.lower())
+        titles[office.pk] = title
+    return titles
+
+
+def render_office(exporter_class, model, query, office_id, language, path):
+    """Write the reports of one office into a workbook of its own at ``path``."""
+    queryset = model._default_manager.all()
+    queryset.query = pickle.loads(query)
+    exporter = exporter_class()
+    with translation.override(language):
+        workbook = exporter.create_workbook()
+        last_row = exporter.write_sheet(workbook, queryset.filter(customsoffice=office_id))
+        workbook.save(path)
+    return office_id, last_row
+
+
+def write_summary(exporter, workbook, offices, report_counts, last_rows):
+    """Add the summary sheet: reports and rows per office, then the totals."""
+    sheet = workbook.create_sheet(title=str(SUMMARY_TITLE))
+    exporter.register_cell_styles(sheet)
+    header_style = exporter.named_styles.get(exporter.header_style)
+    row_styles = [exporter.named_styles.get(name) for name in exporter.row_styles]
+
+    for letter, width in zip('ABC', [40, 15, 15]):
+        sheet.column_dimensions[letter].width = width
+
+    headers = [str(_('Customs Office')), str(_('Reports')), str(_('Rows'))]
+    sheet.append([styled_cell(sheet, header, header_style) for header in headers])
+
+    rows = [[office.name, report_counts[office.pk], last_rows[office.pk] - 1] for office in offices]
+    rows.append([str(_('Total')), sum(row[1] for row in rows), sum(row[2] for row in rows)])
+    for number, row in enumerate(rows, start=1):
+        row_style = row_styles[number % len(row_styles)]
+        sheet.append([styled_cell(sheet, value, row_style) for value in row])
+
+
+def write_workbook(exporter, queryset, output, offices, titles, report_counts, last_rows):
+    """Write every office into one workbook in this process."""
+    workbook = exporter.create_workbook()
+    write_summary(exporter, workbook, offices, report_counts, last_rows)
+    for office in offices:
+        exporter.write_sheet(workbook, queryset.filter(customsoffice=office.pk), title=titles[office.pk])
+    workbook.save(output)
+
+
+def assemble_workbook(exporter, offices, titles, report_counts, last_rows, paths, output):
+    """
+    Copy the office worksheets written by the workers into one workbook.
+
+    Return False, without writing anything, when a worker's style table
+    differs from the assembled workbook's, as the sheets would then point at
+    the wrong cell formats.
+    """
+    workbook = exporter.create_workbook()
+    write_summary(exporter, workbook, offices, report_counts, last_rows)
+    for office in offices:
+        # Placeholder sheets, replaced below by the workers' sheets
+        sheet = workbook.create_sheet(title=titles[office.pk])
+        if exporter.auto_filter:
+            sheet.auto_filter.ref = exporter.get_auto_filter_ref(last_rows[office.pk])
+
+    with tempfile.TemporaryFile() as skeleton:
+        workbook.save(skeleton)
+        skeleton.seek(0)
+        with zipfile.ZipFile(skeleton) as source:
+            styles = source.read('xl/styles.xml')
+            for path in paths.values():
+                with zipfile.ZipFile(path) as part:
+                    if part.read('xl/styles.xml') != styles:
+                        return False
+
+            # openpyxl numbers worksheet parts by position; the summary comes first
+            sheet_parts = {
+                f'xl/worksheets/sheet{position}.xml': paths[office.pk]
+                for position, office in enumerate(offices, start=2)
+            }
+            with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as target:
+                for item in source.infolist():
+                    info = zipfile.ZipInfo(item.filename, date_time=item.date_time)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    if item.filename in sheet_parts:
+                        with zipfile.ZipFile(sheet_parts[item.filename]) as part, \
+                                part.open('xl/worksheets/sheet1.xml') as sheet, \
+                                target.open(info, 'w', force_zip64=True) as destination:
+                            shutil.copyfileobj(sheet, destination)
+                    else:
+                        target.writestr(info, source.read(item.filename))
+    return True
+
+
+def write_office_workbook(queryset, output, progress=None, exporter_class=ReportExporter, workers=1):
+    """
+    Write ``queryset`` into ``output`` with one sheet per customs office and a summary sheet.
+
+    Offices are rendered in this process, or in a pool of ``workers``
+    processes when more than one is given. ``progress`` receives the number
+    of reports written so far as offices finish.
+    """
+    exporter = exporter_class()
+    offices = list(CustomsOffice.objects.filter(pk__in=queryset.values('customsoffice')).order_by('name'))
+    titles = get_sheet_titles(offices)
+    report_counts = dict(queryset.order_by().values_list('customsoffice').annotate(Count('pk')))
+    workers = min(workers, len(offices))
+
+    query = pickle.dumps(queryset.query)
+    language = translation.get_language()
+    with tempfile.TemporaryDirectory() as shard_dir:
+        paths = {office.pk: os.path.join(shard_dir, f'{office.pk}.xlsx') for office in offices}
+        tasks = [
+            (exporter_class, queryset.model, query, office.pk, language, paths[office.pk])
+            for office in offices
+        ]
+        last_rows = {}
+
+        def finished(office_id, last_row):
+            last_rows[office_id] = last_row
+            if progress:
+                progress(sum(report_counts[office_id] for office_id in last_rows))
+
+        if workers > 1:
+            # Forked workers open connections of their own; sharing the
+            # parent's would mix up the database protocol on the socket
+            connections.close_all()
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                for future in as_completed([pool.submit(render_office, *task) for task in tasks]):
+                    finished(*future.result())
+        else:
+            for task in tasks:
+                finished(*render_office(*task))
+
+        if not assemble_workbook(exporter, offices, titles, report_counts, last_rows, paths, output):
+            output.seek(0)
+            output.truncate()
+            write_workbook(exporter, queryset, output, offices, titles, report_counts, last_rows)
+
+
+def write_office_workbook_in_parallel(queryset, output, progress=None):
+    """The export worker's writer: ``write_office_workbook`` with ``EXPORT_WORKERS`` processes."""
+    write_office_workbook(queryset, output, progress=progress, workers=settings.EXPORT_WORKERS)
@@ -0,0 +1,22 @@
+from django import template
+from django.contrib.admin.templatetags.admin_list import result_headers
+from django.contrib.admin.views.main import ALL_VAR
+from django.urls import reverse
+
+register = template.Library()
+
+
+@register.inclusion_tag('admin/virtual_change_list_results.html')
+def virtual_result_list(cl):
+    """The header of the change list table, whose rows the virtual scrolling table loads."""
+    headers = list(result_headers(cl))
+    rows_url = reverse(
+        f'admin:{cl.opts.app_label}_{cl.opts.model_name}_changelist_rows',
+        current_app=cl.model_admin.admin_site.name,
+    )
+    return {
+        'cl': cl,
+        'result_headers': headers,
+        'num_sorted_fields': sum(1 for header in headers if header['sortable'] and header['sorted']),
+        'rows_url': rows_url + cl.get_query_string(remove=[ALL_VAR]),
+    }
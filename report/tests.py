@@ -1,3 +1,889 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
+from urllib.parse import urlencode
 
-# Create your tests here.
+import io
+import zipfile
+
+import openpyxl
+import pandas as pd
+
+from django.conf import settings
+from django.contrib.admin import site
+from django.contrib.auth.models import Permission, User
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connection
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.http import FileResponse
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.test import APIClient
+from django.test.utils import CaptureQueriesContext
+
+from customs_registry.models import (
+    AdministrationCodex, BasisForDiscovery, Country, CustomsOffice, CustomsOfficer, CustomsPoint,
+    LettersForAction, MethodOfDiscovery, MilitaryName, Position, Product, ReasonForRuleViolation,
+    StoredGood, StoredGoodImage, TransportCompanyName, UnitOfMeasurement, VehicleBrand, Violation, Workgroup
+)
+from .export_cache import evict, get_data_version
+from .exporters import ReportWithSummariesExporter
+from .sharding import write_office_workbook
+from .search import get_search_document_queryset, get_search_text, update_search_documents
+from .jobs import EXPORT_TYPES, claim_next_job, enqueue_export, get_job_queryset, run_export_job
+from .models import AssignedLetter, AssignedTask, ExportJob, ExportRun, ExportWatermark, PrebuiltExport, Report, UserProfile, Witness
+from .permissions import filter_editable_reports
+from .prebuilt import build_prebuilt_export, is_current
+from .admin import AdministrationCodexFilter, ReportAdmin
+from .utils import build_report_frame, export_report_to_excel, export_reports_by_office, write_report_parquet
+
+
+class ReportFixturesMixin:
+    """Reference data plus a helper that builds a fully populated report."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.office = CustomsOffice.objects.create(name='Office', code='O1')
+        cls.point = CustomsPoint.objects.create(name='Point', code='P1', customsoffice=cls.office)
+        cls.country = Country.objects.create(name='Turkmenistan', code='TKM')
+        cls.officer = CustomsOfficer.objects.create(
+            name='Aman', surname='Amanow',
+            position=Position.objects.create(name='Inspector'),
+            militaryname=MilitaryName.objects.create(name='Captain'),
+        )
+        cls.basis = BasisForDiscovery.objects.create(name='Basis')
+        cls.method = MethodOfDiscovery.objects.create(name='Method')
+        cls.codexes = [AdministrationCodex.objects.create(name=f'Codex {i}') for i in range(2)]
+        cls.product = Product.objects.create(name='Cigarettes')
+        cls.unit = UnitOfMeasurement.objects.create(name='pcs')
+        cls.reason = ReasonForRuleViolation.objects.create(name='Luggage')
+        cls.workgroup = Workgroup.objects.create(name='Workgroup')
+        cls.letter_for_action = LettersForAction.objects.create(name='Letter')
+        cls.vehicle_brand = VehicleBrand.objects.create(name='Kamaz')
+        cls.transport_company = TransportCompanyName.objects.create(name='Transport')
+
+    @classmethod
+    def create_report(cls, number, goods=2):
+        violation = Violation.objects.create(
+            violation_type='individual',
+            violator_name='Name',
+            violator_surname=f'Surname {number}',
+            passport_number=f'P{number}',
+            nationality=cls.country,
+        )
+        report = Report.objects.create(
+            ish_toplum_number=f'IT{number}',
+            protocol_number=f'PR{number}',
+            report_date=date(2024, 1, 1),
+            customsoffice=cls.office,
+            customspoint=cls.point,
+            customsofficer=cls.officer,
+            basisfordiscovery=cls.basis,
+            methodofdiscovery=cls.method,
+            violation=violation,
+            entry_exit_transit='giriş',
+            from_country=cls.country,
+            to_country=cls.country,
+            vehicle_brand=cls.vehicle_brand,
+            transport_company=cls.transport_company,
+            user=cls.user,
+        )
+        report.administration_codexes.set(cls.codexes)
+        Witness.objects.create(report=report, fullname='Witness', address='Address')
+        task = AssignedTask.objects.create(
+            report=report, workgroup=cls.workgroup, trb=f'TRB{number}',
+            salnan_jerime=Decimal('100.00'), tolenen_manat=Decimal('50.00'),
+        )
+        AssignedLetter.objects.create(
+            assignedtask=task, letterforaction=cls.letter_for_action, number=f'L{number}', date=date(2024, 2, 1),
+        )
+        for amount in range(1, goods + 1):
+            StoredGood.objects.create(
+                report=report, product=cls.product, amount=Decimal(amount),
+                unitofmeasurement=cls.unit, reasonforruleviolation=cls.reason,
+            )
+        return report
+
+
+class TemporaryExportCacheMixin:
+    """Point the export cache at a fresh directory for every test."""
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        override = self.settings(EXPORT_CACHE_DIR=self.cache_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class ExportReportToExcelQueryTests(ReportFixturesMixin, TemporaryExportCacheMixin, TestCase):
+
+    def count_export_queries(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with CaptureQueriesContext(connection) as context:
+            response = export_report_to_excel(None, request, Report.objects.all())
+            b''.join(response.streaming_content)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_report_count(self):
+        self.create_report(1)
+        single_report_queries = self.count_export_queries()
+
+        for number in range(2, 7):
+            self.create_report(number)
+        many_reports_queries = self.count_export_queries()
+
+        self.assertEqual(single_report_queries, many_reports_queries)
+
+
+class ExportCacheTests(ReportFixturesMixin, TemporaryExportCacheMixin, TestCase):
+
+    def export(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with CaptureQueriesContext(connection) as context:
+            response = export_report_to_excel(None, request, Report.objects.all())
+            content = b''.join(response.streaming_content)
+        return content, len(context.captured_queries)
+
+    def test_unchanged_data_is_served_from_cache(self):
+        self.create_report(1)
+        first, first_queries = self.export()
+        second, second_queries = self.export()
+
+        self.assertEqual(first, second)
+        self.assertLess(second_queries, first_queries)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_changed_data_builds_a_new_file(self):
+        report = self.create_report(1)
+        self.export()
+        report.protocol_number = 'PR-changed'
+        report.save()
+        self.export()
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_changed_related_rows_build_a_new_file(self):
+        report = self.create_report(1)
+        self.export()
+        witness = report.witnesses.get()
+        witness.fullname = 'Changed'
+        witness.save()
+        self.export()
+        self.country.name = 'Renamed'
+        self.country.save()
+        self.export()
+        report.administration_codexes.remove(self.codexes[0])
+        self.export()
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), 4)
+
+    def test_data_version_is_a_single_cache_read(self):
+        get_data_version()
+        with CaptureQueriesContext(connection) as context:
+            get_data_version()
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertIn('django_cache', context.captured_queries[0]['sql'])
+
+    def test_least_recently_used_files_are_evicted(self):
+        for name, mtime in [('old', 1), ('used', 3), ('new', 2)]:
+            path = os.path.join(self.cache_dir, f'{name}.xlsx')
+            with open(path, 'wb') as output:
+                output.write(b'x' * 10)
+            os.utime(path, (mtime, mtime))
+
+        with self.settings(EXPORT_CACHE_MAX_SIZE=20):
+            evict()
+
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['new.xlsx', 'used.xlsx'])
+
+
+class OfficeWorkbookTests(ReportFixturesMixin, TemporaryExportCacheMixin, TestCase):
+
+    def test_one_sheet_per_office_and_a_summary(self):
+        self.create_report(1)
+        report = self.create_report(2, goods=0)
+        report.customsoffice = CustomsOffice.objects.create(name='Border: North/East', code='O2')
+        report.save()
+
+        with tempfile.TemporaryFile() as output:
+            write_office_workbook(Report.objects.all(), output, workers=1)
+            workbook = openpyxl.load_workbook(output)
+
+        self.assertEqual(workbook.sheetnames, ['Summary', 'Border  North East', 'Office'])
+        summary = [[cell.value for cell in row] for row in workbook['Summary'].iter_rows(min_row=2)]
+        self.assertEqual(summary, [['Border: North/East', 1, 1], ['Office', 1, 2], ['Total', 2, 3]])
+        self.assertEqual(workbook['Office'].max_row, 3)
+        self.assertEqual(workbook['Office']['B2'].value, 'IT1')
+        self.assertEqual(workbook['Office'].auto_filter.ref, 'A1:AQ3')
+
+    def test_admin_action_renders_in_the_request_process(self):
+        self.create_report(1)
+        report = self.create_report(2)
+        report.customsoffice = CustomsOffice.objects.create(name='Second', code='O2')
+        report.save()
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.settings(EXPORT_WORKERS=4), patch('report.sharding.ProcessPoolExecutor') as pool:
+            response = export_reports_by_office(None, request, Report.objects.all())
+            workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        pool.assert_not_called()
+        self.assertEqual(workbook.sheetnames, ['Summary', 'Office', 'Second'])
+
+
+class ReportFrameTests(ReportFixturesMixin, TestCase):
+
+    def test_amounts_stay_exact_and_task_sums_are_given_once_per_report(self):
+        self.create_report(1)
+        self.create_report(2, goods=0)
+        frame = build_report_frame(Report.objects.order_by('pk'))
+
+        self.assertEqual(frame['amount'].tolist()[:2], [Decimal('1.00'), Decimal('2.00')])
+        self.assertIsInstance(frame['amount'][0], Decimal)
+        self.assertEqual(frame['salnan_jerime'].tolist(), [Decimal('100.00'), None, Decimal('100.00')])
+        self.assertEqual(frame['assigned_tasks'].sum(), 2)
+        self.assertEqual(frame['tolenen_manat'].dropna().sum(), Decimal('100.00'))
+
+        output = io.BytesIO()
+        write_report_parquet(Report.objects.order_by('pk'), output)
+        output.seek(0)
+        self.assertIsInstance(pd.read_parquet(output)['salnan_jerime'][0], Decimal)
+
+
+class TemporaryMediaRootMixin:
+    """Store uploaded and generated files in a fresh directory for every test."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = self.settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class CaseBundleTests(ReportFixturesMixin, TemporaryExportCacheMixin, TemporaryMediaRootMixin, TestCase):
+
+    def test_bundle_holds_the_workbook_and_attached_files(self):
+        report = self.create_report(1)
+        task = report.assigned_tasks.get()
+        task.bilermen_nusga.save('expert.pdf', ContentFile(b'%PDF expert'))
+        good = report.stored_goods.first()
+        image = StoredGoodImage(stored_good=good)
+        image.image.save('photo.jpg', ContentFile(b'jpeg data'))
+        missing = StoredGoodImage.objects.create(stored_good=good, image='stored_good_images/gone.jpg')
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('total-report-data-bundle'), {'ids': str(report.pk)})
+
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        entries = {info.filename: info for info in archive.infolist()}
+        folder = f'{report.pk}_PR1'
+        image_name = f'{folder}/stored_goods/{good.pk}/{image.pk}_{os.path.basename(image.image.name)}'
+        task_name = f'{folder}/assigned_tasks/{task.pk}/bilermen_nusga_{os.path.basename(task.bilermen_nusga.name)}'
+
+        self.assertEqual(archive.read(image_name), b'jpeg data')
+        self.assertEqual(entries[image_name].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.read(task_name), b'%PDF expert')
+        self.assertEqual(entries['reports.xlsx'].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.read('missing_files.txt').decode(), f'{missing.image.name}\n')
+        self.assertEqual(openpyxl.load_workbook(archive.open('reports.xlsx')).active['B2'].value, 'IT1')
+
+    def test_bundle_needs_report_ids(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('total-report-data-bundle'))
+        self.assertEqual(response.status_code, 400)
+
+
+class ReportSummaryTests(ReportFixturesMixin, TestCase):
+
+    def write_workbook(self):
+        with tempfile.TemporaryFile() as output:
+            ReportWithSummariesExporter().write(Report.objects.all(), output)
+            return openpyxl.load_workbook(output)
+
+    def sheet_values(self, sheet):
+        return [[cell.value for cell in row] for row in sheet.iter_rows(min_row=2)]
+
+    def test_summary_sheets(self):
+        self.create_report(1)
+        self.create_report(2, goods=1)
+        workbook = self.write_workbook()
+
+        self.assertEqual(workbook.sheetnames[1:], ['Reports per office', 'Fines', 'Seized goods'])
+        self.assertEqual(self.sheet_values(workbook['Reports per office']), [['Office', '01.2024', 2]])
+        self.assertEqual(self.sheet_values(workbook['Fines']), [['Office', 2, 200, 100, 100]])
+        self.assertEqual(self.sheet_values(workbook['Seized goods']), [['Cigarettes', 'pcs', 4, 3, 2]])
+
+    def test_summaries_cost_the_same_queries_for_any_number_of_reports(self):
+        self.create_report(1)
+        with CaptureQueriesContext(connection) as single_report:
+            self.write_workbook()
+
+        for number in range(2, 7):
+            self.create_report(number)
+        with CaptureQueriesContext(connection) as many_reports:
+            self.write_workbook()
+
+        self.assertEqual(len(single_report.captured_queries), len(many_reports.captured_queries))
+
+
+class IncrementalExportTests(ReportFixturesMixin, TemporaryExportCacheMixin, TestCase):
+
+    def export_changes(self, report_ids=None):
+        self.client.force_login(self.user)
+        if report_ids is None:
+            report_ids = list(Report.objects.values_list('pk', flat=True))
+        return self.client.post(reverse('admin:report_report_changelist'), {
+            'action': 'reports_since_last_export',
+            '_selected_action': report_ids,
+        })
+
+    def exported_numbers(self, response):
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        return sorted(value for (value,) in workbook.active.iter_rows(min_row=2, min_col=2, max_col=2, values_only=True))
+
+    def test_only_changes_since_the_last_export_are_exported(self):
+        first = self.create_report(1)
+        second = self.create_report(2)
+        self.assertEqual(self.exported_numbers(self.export_changes()), ['IT1', 'IT1', 'IT2', 'IT2'])
+        self.assertTrue(ExportWatermark.objects.filter(user=self.user, export_type='reports').exists())
+
+        # Nothing changed: no file, only a message
+        response = self.export_changes()
+        self.assertEqual(response.status_code, 302)
+
+        second.stored_goods.first().save()
+        self.assertEqual(self.exported_numbers(self.export_changes()), ['IT2', 'IT2'])
+
+        first.stored_goods.first().delete()
+        self.assertEqual(self.exported_numbers(self.export_changes()), ['IT1'])
+
+    def test_each_selection_has_its_own_watermark(self):
+        first = self.create_report(1)
+        second = self.create_report(2)
+        self.assertEqual(self.exported_numbers(self.export_changes([first.pk])), ['IT1', 'IT1'])
+        self.assertEqual(self.exported_numbers(self.export_changes([second.pk])), ['IT2', 'IT2'])
+        self.assertEqual(self.export_changes([first.pk]).status_code, 302)
+
+    def test_deleting_a_report_does_not_touch_it_per_child(self):
+        reports = [self.create_report(1, goods=3), self.create_report(2, goods=3)]
+        table = f'UPDATE "{Report._meta.db_table}"'
+        with CaptureQueriesContext(connection) as context:
+            reports[0].delete()
+            Report.objects.filter(pk=reports[1].pk).delete()
+        self.assertEqual([query['sql'] for query in context.captured_queries if query['sql'].startswith(table)], [])
+
+
+class ExportJobTests(ReportFixturesMixin, TemporaryMediaRootMixin, TestCase):
+
+    def test_enqueued_query_is_rebuilt_by_the_worker(self):
+        self.create_report(1)
+        report = self.create_report(2)
+        job = enqueue_export(self.user, 'reports', Report.objects.filter(protocol_number='PR2'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.STATUS_PENDING)
+        self.assertEqual(list(get_job_queryset(job)), [report])
+
+    def test_jobs_are_claimed_oldest_first_and_once(self):
+        jobs = [enqueue_export(self.user, 'reports', Report.objects.all()) for _ in range(2)]
+
+        claimed = [claim_next_job(), claim_next_job(), claim_next_job()]
+        self.assertEqual(claimed, [jobs[0], jobs[1], None])
+        self.assertEqual(claimed[0].status, ExportJob.STATUS_RUNNING)
+        self.assertIsNotNone(claimed[0].started_at)
+
+    @skipUnless(connection.vendor == 'postgresql', 'SKIP LOCKED needs PostgreSQL')
+    def test_claim_skips_locked_jobs(self):
+        enqueue_export(self.user, 'reports', Report.objects.all())
+        with CaptureQueriesContext(connection) as context:
+            claim_next_job()
+        self.assertTrue(any('FOR UPDATE SKIP LOCKED' in query['sql'] for query in context.captured_queries))
+
+    def test_jobs_left_running_by_a_lost_worker_are_failed(self):
+        lost = enqueue_export(self.user, 'reports', Report.objects.all())
+        lost.status = ExportJob.STATUS_RUNNING
+        lost.started_at = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT + 1)
+        lost.save()
+        running = enqueue_export(self.user, 'reports', Report.objects.all())
+        running.status = ExportJob.STATUS_RUNNING
+        running.started_at = timezone.now()
+        running.save()
+
+        self.assertIsNone(claim_next_job())
+        lost.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(lost.status, ExportJob.STATUS_FAILED)
+        self.assertTrue(lost.error)
+        self.assertEqual(running.status, ExportJob.STATUS_RUNNING)
+
+    def test_finished_job_has_its_file_and_full_progress(self):
+        self.create_report(1)
+        self.create_report(2)
+        job = enqueue_export(self.user, 'reports', Report.objects.all())
+        writer = import_string(EXPORT_TYPES['reports']['writer'])
+        reported_rows = []
+
+        def write(queryset, output, progress=None):
+            progress(1)
+            reported_rows.append(ExportJob.objects.get(pk=job.pk).processed_rows)
+            writer(queryset, output)
+
+        with patch('report.jobs.import_string', return_value=write):
+            run_export_job(claim_next_job())
+
+        job.refresh_from_db()
+        self.assertEqual(reported_rows, [1])
+        self.assertEqual(job.status, ExportJob.STATUS_DONE)
+        self.assertEqual((job.total_rows, job.processed_rows, job.progress), (2, 2, 100))
+        with job.file.open('rb') as output:
+            self.assertEqual(openpyxl.load_workbook(output).active.max_row, 5)
+
+    def test_failed_job_keeps_the_error(self):
+        enqueue_export(self.user, 'reports', Report.objects.all())
+
+        def write(queryset, output, progress=None):
+            raise ValueError('Broken writer')
+
+        with patch('report.jobs.import_string', return_value=write):
+            job = run_export_job(claim_next_job())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.STATUS_FAILED)
+        self.assertIn('Broken writer', job.error)
+        self.assertFalse(job.file)
+
+    def test_only_the_owner_downloads_the_file(self):
+        enqueue_export(self.user, 'reports', Report.objects.all())
+        job = run_export_job(claim_next_job())
+        other = User.objects.create_user('clerk', password='password', is_staff=True)
+        url = reverse('admin:report_exportjob_download', args=[job.pk])
+
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertIsInstance(response, FileResponse)
+        response.close()
+
+
+class PrebuiltExportTests(ReportFixturesMixin, TemporaryExportCacheMixin, TemporaryMediaRootMixin, TestCase):
+
+    def prebuild(self):
+        call_command('prebuild_office_exports', year=2024, languages=['tk'], stdout=io.StringIO())
+
+    def download(self, prebuilt, user=None):
+        self.client.force_login(user or self.user)
+        return self.client.get(reverse('admin:report_prebuiltexport_download', args=[prebuilt.pk]))
+
+    def test_prebuilt_files_need_the_permission_to_view_reports(self):
+        self.create_report(1)
+        self.prebuild()
+        prebuilt = PrebuiltExport.objects.get()
+        clerk = User.objects.create_user('clerk', password='password', is_staff=True)
+
+        self.assertEqual(self.download(prebuilt, clerk).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:report_prebuiltexport_changelist')).status_code, 403)
+
+        clerk.user_permissions.add(Permission.objects.get(codename='view_report'))
+        clerk = User.objects.get(pk=clerk.pk)
+        self.assertIsInstance(self.download(prebuilt, clerk), FileResponse)
+
+    def test_prebuilt_file_is_served_until_the_data_changes(self):
+        report = self.create_report(1)
+        self.prebuild()
+        prebuilt = PrebuiltExport.objects.get(customsoffice=self.office, year=2024, language='tk')
+        built_at = prebuilt.built_at
+        self.assertEqual(prebuilt.total_rows, 1)
+
+        # Unchanged data: the command skips the office and the stored file is served
+        self.prebuild()
+        prebuilt.refresh_from_db()
+        self.assertEqual(prebuilt.built_at, built_at)
+        self.assertIsInstance(self.download(prebuilt), FileResponse)
+
+        # Changed data: the workbook is built live
+        report.stored_goods.first().delete()
+        response = self.download(prebuilt)
+        self.assertNotIsInstance(response, FileResponse)
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(workbook.active.max_row, 2)
+
+    def test_prebuilt_file_is_outdated_by_changes_to_any_exported_row(self):
+        report = self.create_report(1)
+        prebuilt, built = build_prebuilt_export(self.office, 2024, 'tk')
+
+        def change_witness():
+            witness = report.witnesses.get()
+            witness.fullname = 'Changed'
+            witness.save()
+
+        def change_letter():
+            letter = AssignedLetter.objects.get(assignedtask__report=report)
+            letter.number = 'L-changed'
+            letter.save()
+
+        def rename_product():
+            self.product.name = 'Renamed'
+            self.product.save()
+
+        changes = [
+            change_witness,
+            change_letter,
+            lambda: report.administration_codexes.set(self.codexes[:1]),
+            lambda: report.administration_codexes.set(self.codexes),
+            rename_product,
+        ]
+        for change in changes:
+            self.assertTrue(is_current(prebuilt))
+            change()
+            self.assertFalse(is_current(prebuilt))
+            prebuilt, built = build_prebuilt_export(self.office, 2024, 'tk')
+
+
+class ExportInstrumentationTests(ReportFixturesMixin, TemporaryExportCacheMixin, TestCase):
+
+    def export(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        response = export_report_to_excel(None, request, Report.objects.all())
+        b''.join(response.streaming_content)
+
+    def test_runs_are_recorded_only_when_enabled(self):
+        self.create_report(1)
+        self.create_report(2)
+
+        self.export()
+        self.assertFalse(ExportRun.objects.exists())
+
+        with self.settings(EXPORT_INSTRUMENTATION=True, EXPORT_CACHE_DIR=tempfile.mkdtemp(dir=self.cache_dir)):
+            self.export()
+        run = ExportRun.objects.get()
+        self.assertEqual(run.name, 'ReportExporter.xlsx')
+        self.assertEqual(run.user, self.user)
+        self.assertEqual(run.rows, 4)
+        self.assertGreater(run.query_count, 0)
+        self.assertGreater(run.peak_memory, 0)
+        self.assertGreater(run.saving_time, 0)
+
+    def test_users_only_see_their_own_runs(self):
+        clerk = User.objects.create_user('clerk', password='password', is_staff=True)
+        own = ExportRun.objects.create(name='ReportExporter.xlsx', user=clerk)
+        ExportRun.objects.create(name='ReportExporter.xlsx', user=self.user)
+
+        self.client.force_login(clerk)
+        response = self.client.get(reverse('admin:report_exportrun_changelist'))
+        self.assertEqual(list(response.context['cl'].result_list), [own])
+
+
+class ReportChangeListQueryTests(ReportFixturesMixin, TestCase):
+
+    def create_report_with_images(self, number, images=4):
+        report = self.create_report(number)
+        for good in report.stored_goods.all():
+            for image in range(images):
+                StoredGoodImage.objects.create(stored_good=good, image=f'stored_good_images/{good.pk}_{image}.jpg')
+        return report
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def get_changelist(self, **params):
+        return self.client.get(reverse('admin:report_report_changelist'), params)
+
+    def count_changelist_queries(self, **params):
+        self.get_changelist(**params)  # Fill the cached filter choices and facet counts
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_changelist(**params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_listed_reports(self):
+        self.create_report_with_images(1)
+        single_report_queries = self.count_changelist_queries()
+        single_report_show_all_queries = self.count_changelist_queries(all='')
+
+        for number in range(2, 6):
+            self.create_report_with_images(number, images=20)
+        self.assertEqual(self.count_changelist_queries(), single_report_queries)
+        self.assertEqual(self.count_changelist_queries(all=''), single_report_show_all_queries)
+
+    def test_stored_goods_show_the_first_images_and_the_rest_as_a_count(self):
+        self.create_report_with_images(1, images=20)
+        response = self.get_changelist()
+        self.assertContains(response, 'title="Cigarettes" />', count=2 * ReportAdmin.max_stored_good_images)
+        self.assertContains(response, '+17 more', count=2)
+
+
+class ReportFacetCountTests(ReportFixturesMixin, TestCase):
+
+    def get_facet_queries(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('admin:report_report_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in context.captured_queries if '__c"' in query['sql']]
+
+    def test_facet_counts_are_cached_until_a_report_changes(self):
+        self.client.force_login(self.user)
+        for number in range(1, 3):
+            self.create_report(number)
+        response, queries = self.get_facet_queries(entry_exit_transit='giriş')
+        self.assertTrue(queries)
+        self.assertContains(response, 'Giriş (2)')
+        self.assertEqual(self.get_facet_queries(entry_exit_transit='giriş')[1], [])
+
+        report = self.create_report(3)
+        response, queries = self.get_facet_queries(entry_exit_transit='giriş')
+        self.assertTrue(queries)
+        self.assertContains(response, 'Giriş (3)')
+
+        report.delete()
+        self.assertContains(self.get_facet_queries(entry_exit_transit='giriş')[0], 'Giriş (2)')
+
+
+class ReportKeysetPaginationTests(ReportFixturesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def get_page(self, query_string='', **params):
+        response = self.client.get(reverse('admin:report_report_changelist') + query_string, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_cursors_walk_every_report_once_newest_first(self):
+        reports = [self.create_report(number) for number in range(1, 13)]
+        cl = self.get_page()
+        self.assertTrue(cl.keyset_pagination)
+        self.assertIsNone(cl.previous_page_url)
+
+        pages = [list(cl.result_list)]
+        while cl.next_page_url:
+            cl = self.get_page(cl.next_page_url)
+            pages.append(list(cl.result_list))
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual([report for page in pages for report in page], reports[::-1])
+
+        cl = self.get_page(cl.previous_page_url)
+        self.assertEqual(list(cl.result_list), pages[1])
+        cl = self.get_page(cl.previous_page_url)
+        self.assertEqual(list(cl.result_list), pages[0])
+        self.assertIsNone(cl.previous_page_url)
+
+    @skipUnless(connection.vendor == 'postgresql', 'The plan of the page query is checked on PostgreSQL')
+    def test_later_pages_are_an_index_range_scan(self):
+        for number in range(1, 8):
+            self.create_report(number)
+        cl = self.get_page()
+        cursor = cl.get_cursor(cl.result_list[-1])
+        queryset = cl.queryset.filter(cl.get_keyset_condition(cl.parse_cursor(cursor), after=True))[:cl.list_per_page + 1]
+        with connection.cursor() as db_cursor:
+            # The table is tiny: make the planner show whether the index can serve the page at all
+            db_cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn('Index Scan using report_created_desc', plan)
+        self.assertRegex(plan, r'Index Cond: \(created_at <=')
+        self.assertNotIn('IS NULL', plan)
+
+    def test_sorting_by_a_column_uses_numbered_pages(self):
+        for number in range(1, 8):
+            self.create_report(number)
+        self.assertFalse(self.get_page(o='1').keyset_pagination)
+        response = self.client.get(reverse('admin:report_report_changelist'), {'after': 'not-a-cursor'})
+        self.assertRedirects(response, reverse('admin:report_report_changelist') + '?e=1')
+
+
+class ReportVirtualShowAllTests(ReportFixturesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.reports = [self.create_report(number) for number in range(1, 8)]
+
+    def load_rows(self, **params):
+        url = reverse('admin:report_report_changelist_rows') + '?' + urlencode(params)
+        rows = []
+        while url:
+            data = self.client.get(url).json()
+            rows += data['rows']
+            url = data['next']
+        return rows
+
+    def test_show_all_page_renders_no_rows(self):
+        response = self.client.get(reverse('admin:report_report_changelist'), {'all': ''})
+        self.assertTrue(response.context['cl'].virtual_show_all)
+        self.assertNotContains(response, 'class="action-select"')
+        self.assertContains(response, reverse('admin:report_report_changelist_rows'))
+
+    @patch.object(ReportAdmin, 'virtual_page_size', 3)
+    def test_rows_are_loaded_in_pages(self):
+        rows = self.load_rows()
+        self.assertEqual([row['pk'] for row in rows], [str(report.pk) for report in reversed(self.reports)])
+        self.assertIn('class="action-select"', rows[0]['html'])
+
+        # Sorted by a column
+        rows = self.load_rows(o='-1')
+        self.assertEqual(sorted(row['pk'] for row in rows), sorted(str(report.pk) for report in self.reports))
+
+    def test_actions_on_all_rows_use_the_filters(self):
+        kept = self.reports[0]
+        kept.administration_codexes.remove(self.codexes[1])
+        url = reverse('admin:report_report_changelist') + f'?all=&administration_codexes={self.codexes[1].pk}'
+        self.client.post(url, {
+            'action': 'delete_selected',
+            'select_across': '1',
+            'index': '0',
+            '_selected_action': [str(self.reports[1].pk)],
+            'post': 'yes',
+        })
+        self.assertEqual(list(Report.objects.all()), [kept])
+
+
+class AdministrationCodexFilterTests(ReportFixturesMixin, TestCase):
+
+    def get_lookups(self):
+        request = RequestFactory().get('/')
+        return AdministrationCodexFilter(request, {}, Report, ReportAdmin(Report, site)).lookup_choices
+
+    def test_lookups_are_cached_until_a_codex_changes(self):
+        self.assertEqual(self.get_lookups(), [(codex.pk, codex.name) for codex in self.codexes])
+        codex_table = f'FROM {connection.ops.quote_name(AdministrationCodex._meta.db_table)}'
+        with CaptureQueriesContext(connection) as context:
+            self.get_lookups()
+        self.assertFalse([query for query in context.captured_queries if codex_table in query['sql']])
+
+        self.codexes[0].name = 'Codex 0 renamed'
+        self.codexes[0].save()
+        self.assertIn((self.codexes[0].pk, 'Codex 0 renamed'), self.get_lookups())
+
+    def test_filter_lists_each_report_with_the_codex_once(self):
+        first, second = self.create_report(1), self.create_report(2)
+        second.administration_codexes.remove(self.codexes[1])
+        self.client.force_login(self.user)
+
+        def filtered(codex):
+            response = self.client.get(reverse('admin:report_report_changelist'), {'administration_codexes': codex.pk})
+            return list(response.context['cl'].result_list)
+
+        self.assertEqual(filtered(self.codexes[0]), [second, first])
+        self.assertEqual(filtered(self.codexes[1]), [first])
+
+
+class ReportChangeFormQueryTests(ReportFixturesMixin, TestCase):
+
+    def test_inline_selects_do_not_query_the_lookup_tables(self):
+        report = self.create_report(1, goods=30)
+        self.client.force_login(self.user)
+        url = reverse('admin:report_report_change', args=[report.pk])
+        self.client.get(url)  # Fill the cached choice lists
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertContains(response, f'<option value="{self.unit.pk}" selected>pcs</option>', count=30, html=True)
+        lookup_tables = [
+            f'FROM {connection.ops.quote_name(model._meta.db_table)}'
+            for model in (UnitOfMeasurement, ReasonForRuleViolation, Workgroup, LettersForAction)
+        ]
+        lookup_queries = [query['sql'] for query in context.captured_queries if any(table in query['sql'] for table in lookup_tables)]
+        self.assertEqual(lookup_queries, [])
+
+    def test_new_lookup_rows_appear_in_the_inline_selects(self):
+        # The cache and its version tokens are shared by all worker processes
+        self.assertIsInstance(caches['default'], DatabaseCache)
+        report = self.create_report(1)
+        self.client.force_login(self.user)
+        url = reverse('admin:report_report_change', args=[report.pk])
+        self.assertNotContains(self.client.get(url), 'New workgroup')
+
+        workgroup = Workgroup.objects.create(name='New workgroup')
+        self.assertContains(self.client.get(url), f'<option value="{workgroup.pk}">New workgroup</option>', html=True)
+
+
+class ReportPermissionTests(ReportFixturesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clerk = User.objects.create_user('clerk', is_staff=True)
+        self.colleague = User.objects.create_user('colleague', is_staff=True)
+        UserProfile.objects.create(user=self.clerk).related_users.add(self.colleague)
+        self.reports = {}
+        for number, user in enumerate([self.user, self.clerk, self.colleague], start=1):
+            report = self.create_report(number)
+            Report.objects.filter(pk=report.pk).update(user=user)
+            self.reports[user.username] = Report.objects.get(pk=report.pk)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.clerk
+
+    def test_editable_users_are_looked_up_once_per_request(self):
+        model_admin = ReportAdmin(Report, site)
+        with self.assertNumQueries(1):
+            permissions = {
+                username: model_admin.has_change_permission(self.request, report)
+                for username, report in self.reports.items()
+            }
+            model_admin.has_change_permission(self.request, self.reports['admin'])
+        self.assertEqual(permissions, {'admin': False, 'clerk': True, 'colleague': True})
+
+    def test_editable_reports_filter(self):
+        editable = filter_editable_reports(self.request, Report.objects.all())
+        self.assertCountEqual(editable, [self.reports['clerk'], self.reports['colleague']])
+
+
+class ReportSearchTests(ReportFixturesMixin, TestCase):
+
+    def test_search_text_covers_the_report_and_its_children(self):
+        report = self.create_report(1)
+        text = get_search_text(get_search_document_queryset().get(pk=report.pk))
+        for value in ('IT1', 'PR1', '01.01.2024', 'Surname 1', 'P1', 'Amanow', 'Captain', 'Codex 1', 'Cigarettes', 'admin'):
+            self.assertIn(value, text)
+
+    def test_search_documents_are_rebuilt_once_per_transaction(self):
+        with (
+            patch('report.search.is_supported', return_value=True),
+            patch('report.search.update_search_documents') as update_search_documents,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            first = self.create_report(1, goods=3)
+            second = self.create_report(2)
+            second.violation.save()
+        update_search_documents.assert_called_once_with({first.pk, second.pk})
+
+    @skipUnless(connection.vendor == 'postgresql', 'Full-text search documents need PostgreSQL')
+    def test_search_documents_are_written_with_one_update(self):
+        report_ids = [self.create_report(number).pk for number in range(1, 4)]
+        with CaptureQueriesContext(connection) as context:
+            update_search_documents(report_ids)
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Report.objects.filter(search_document__isnull=False).count(), 3)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Full-text search documents need PostgreSQL')
+    def test_admin_search_uses_the_search_documents(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_report(1)
+            report = self.create_report(2)
+            report.violation.violator_name = 'Merdan'
+            report.violation.save()
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:report_report_changelist'), {'q': 'merd'})
+        self.assertEqual(list(response.context['cl'].result_list), [report])
@@ -5,9 +5,9 @@ from django.contrib.auth.models import User, Group, Permission
 from django.shortcuts import render, redirect
 from django.forms import modelformset_factory
 from django.views.decorators.csrf import csrf_exempt
-from rest_framework import status, permissions, viewsets, generics, filters
+from rest_framework import status, permissions, viewsets, generics
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.views import APIView
@@ -33,6 +33,9 @@ from .serializers import (
     CustomsOfficerSerializer, UserSerializer, GroupSerializer, PermissionSerializer
 )
 from .forms import ReportForm, WitnessForm
+from .bundles import case_bundle_response
+from .search import REPORT_SEARCH_FIELDS, ReportSearchFilter
+from customs_registry.similarity import SimilaritySearchFilter
 
 def get_tokens_for_user(user):
     refresh = RefreshToken.for_user(user)
@@ -163,8 +166,9 @@ class CustomsOfficerViewSet(viewsets.ModelViewSet):
     queryset = CustomsOfficer.objects.all()
     serializer_class = CustomsOfficerSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [SimilaritySearchFilter]
     search_fields = ['name', 'midname','surname', 'militaryname__name', 'position__name']
+    similarity_search_fields = ['name', 'midname', 'surname']
 
 
 class AdministrationCodexViewSet(viewsets.ModelViewSet):
@@ -219,6 +223,9 @@ class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [SimilaritySearchFilter]
+    search_fields = ['name']
+    similarity_search_fields = ['name']
 
 
 class ProductCategoryViewSet(viewsets.ModelViewSet):
@@ -249,6 +256,19 @@ class ReportsForActionViewSet(viewsets.ModelViewSet):
     queryset = Report.objects.all()
     serializer_class = ReportsForActionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [ReportSearchFilter]
+    search_fields = REPORT_SEARCH_FIELDS
+
+    @action(detail=False, methods=['get'])
+    def bundle(self, request):
+        """Stream a ZIP with the workbook and attached files of the reports in ``?ids=1,2,3``."""
+        try:
+            ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+        except ValueError:
+            return Response({'ids': 'Report ids must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids:
+            return Response({'ids': 'Give at least one report id.'}, status=status.HTTP_400_BAD_REQUEST)
+        return case_bundle_response(self.get_queryset().filter(pk__in=ids))
     
 
 def report_form_view(request):
@@ -0,0 +1,167 @@
+// virtual_change_list.js
+// "Show all" change list table: loads the rows page by page from the admin's
+// rows/ JSON view while scrolling and keeps only the visible ones in the page.
+document.addEventListener('DOMContentLoaded', function () {
+    const container = document.querySelector('.virtual-results');
+    if (!container) {
+        return;
+    }
+    const form = document.getElementById('changelist-form');
+    const tbody = container.querySelector('tbody');
+    const columns = container.querySelectorAll('thead th').length;
+    const total = parseInt(container.dataset.count, 10);
+    const toggle = document.getElementById('action-toggle');
+
+    const BUFFER_ROWS = 20;  // Rendered above and below the visible rows
+    const DEFAULT_ROW_HEIGHT = 40;
+
+    const rows = [];  // {pk, html} of every loaded row
+    const selected = new Set();
+    let selectAcross = false;
+    let nextUrl = container.dataset.rowsUrl;
+    let loading = false;
+    let rowHeight = 0;
+
+    function spacer(height) {
+        const row = document.createElement('tr');
+        const cell = document.createElement('td');
+        cell.colSpan = columns;
+        cell.style.cssText = `height: ${height}px; padding: 0; border: 0;`;
+        row.appendChild(cell);
+        return row;
+    }
+
+    function render() {
+        const height = rowHeight || DEFAULT_ROW_HEIGHT;
+        const first = Math.max(0, Math.floor(container.scrollTop / height) - BUFFER_ROWS);
+        const last = Math.min(rows.length, Math.ceil((container.scrollTop + container.clientHeight) / height) + BUFFER_ROWS);
+        const rendered = [];
+        for (let index = first; index < last; index++) {
+            const row = document.createElement('tr');
+            row.innerHTML = rows[index].html;
+            const checkbox = row.querySelector('input.action-select');
+            if (checkbox && (selectAcross || selected.has(checkbox.value))) {
+                checkbox.checked = true;
+                row.classList.add('selected');
+            }
+            rendered.push(row);
+        }
+        tbody.replaceChildren(spacer(first * height), ...rendered, spacer((rows.length - last) * height));
+
+        if (!rowHeight && rendered.length) {
+            // Rows with images are taller: scroll by the average height of the first ones
+            rowHeight = rendered.reduce((sum, row) => sum + row.offsetHeight, 0) / rendered.length;
+            render();
+            return;
+        }
+        if (nextUrl && !loading && container.scrollTop + 2 * container.clientHeight >= rows.length * height) {
+            load();
+        }
+    }
+
+    function load() {
+        loading = true;
+        fetch(nextUrl, {headers: {'Accept': 'application/json'}, credentials: 'same-origin'})
+            .then(response => response.json())
+            .then(data => {
+                rows.push(...data.rows);
+                nextUrl = data.next;
+                loading = false;
+                render();
+                updateCounter();
+            })
+            .catch(() => {
+                // Tried again on the next scroll
+                loading = false;
+            });
+    }
+
+    function show(selector, visible) {
+        form.querySelectorAll(`.actions ${selector}`).forEach(element => element.classList.toggle('hidden', !visible));
+    }
+
+    function updateCounter() {
+        const count = selected.size;
+        form.querySelectorAll('.actions .action-counter').forEach(counter => {
+            counter.textContent = interpolate(
+                ngettext('%(sel)s of %(cnt)s selected', '%(sel)s of %(cnt)s selected', count),
+                {sel: count, cnt: total},
+                true
+            );
+        });
+        show('.action-counter', !selectAcross);
+        show('.all', selectAcross);
+        show('.clear', selectAcross);
+        show('.question', !selectAcross && count > 0 && count === rows.length && total > rows.length);
+        form.querySelectorAll('input.select-across').forEach(input => { input.value = selectAcross ? 1 : 0; });
+        if (toggle) {
+            toggle.checked = selectAcross || (rows.length > 0 && selected.size === rows.length);
+        }
+    }
+
+    function setSelectAcross(value) {
+        selectAcross = value;
+        if (!value) {
+            selected.clear();
+        }
+        render();
+        updateCounter();
+    }
+
+    tbody.addEventListener('change', function (event) {
+        const checkbox = event.target;
+        if (!checkbox.classList.contains('action-select')) {
+            return;
+        }
+        if (selectAcross) {
+            // Leaving "all of them": keep the loaded rows but this one
+            selectAcross = false;
+            rows.forEach(row => selected.add(row.pk));
+        }
+        if (checkbox.checked) {
+            selected.add(checkbox.value);
+        } else {
+            selected.delete(checkbox.value);
+        }
+        checkbox.closest('tr').classList.toggle('selected', checkbox.checked);
+        updateCounter();
+    });
+
+    if (toggle) {
+        toggle.addEventListener('click', function () {
+            selectAcross = false;
+            selected.clear();
+            if (toggle.checked) {
+                rows.forEach(row => selected.add(row.pk));
+            }
+            render();
+            updateCounter();
+        });
+    }
+
+    form.querySelectorAll('.actions .question a').forEach(link => link.addEventListener('click', function (event) {
+        event.preventDefault();
+        setSelectAcross(true);
+    }));
+    form.querySelectorAll('.actions .clear a').forEach(link => link.addEventListener('click', function (event) {
+        event.preventDefault();
+        setSelectAcross(false);
+    }));
+
+    form.addEventListener('submit', function () {
+        // Rows scrolled out of the page are not in the form: send the selection itself.
+        // With select_across the action runs on the filtered queryset and ignores the ids.
+        tbody.querySelectorAll('input.action-select').forEach(checkbox => { checkbox.disabled = true; });
+        const ids = selectAcross ? rows.slice(0, 1).map(row => row.pk) : Array.from(selected);
+        ids.forEach(pk => {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = '_selected_action';
+            input.value = pk;
+            form.appendChild(input);
+        });
+    });
+
+    container.addEventListener('scroll', () => window.requestAnimationFrame(render));
+    load();
+});